@@ -0,0 +1,144 @@
+"""
+Habit analytics computed for all of a user's habits at once.
+
+A user's completions over a date range are loaded with one aggregation and laid out as a boolean
+(habit x day) grid; every statistic is then a vectorized NumPy reduction over that grid instead of a Python
+loop over completion dicts. numpy is imported on first use so it stays out of the cold start of every
+other route.
+"""
+import asyncio
+from datetime import date as _date, timedelta
+
+from fastapi import HTTPException, status
+
+from config import ANALYTICS_MAX_DAYS, COMPLETION_STORAGE
+from db import habits_collection, completions_collection, completion_buckets_collection
+
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+
+def habit_stats(habit_ids, habit_index, completed_dates, date_from: _date, date_to: _date):
+    """
+    Computes the analytics of every habit from columnar completion data.
+
+    :param habit_ids: ids of the habits, one row of the result each
+    :param habit_index: for every completed day, the position of its habit in habit_ids
+    :param completed_dates: for every completed day, its date as datetime64[D] (or "YYYY-MM-DD")
+    :param date_from: first day of the range (inclusive)
+    :param date_to: last day of the range (inclusive)
+    """
+    import numpy as np
+
+    start = np.datetime64(date_from, "D")
+    days = np.arange(start, np.datetime64(date_to, "D") + 1)
+    n_habits, n_days = len(habit_ids), len(days)
+
+    offsets = (np.asarray(completed_dates, dtype="datetime64[D]") - start).astype(np.int64)
+    habit_index = np.asarray(habit_index, dtype=np.int64)
+    in_range = (offsets >= 0) & (offsets < n_days)
+    grid = np.zeros((n_habits, n_days), dtype=bool)
+    grid[habit_index[in_range], offsets[in_range]] = True
+
+    completed = grid.sum(axis=1)
+
+    # Runs of completed days: pad every row with a False on both sides so each run has a rising and a falling
+    # edge in the flattened row-major diff, and no run crosses from one habit into the next.
+    padded = np.zeros((n_habits, n_days + 2), dtype=np.int8)
+    padded[:, 1:-1] = grid
+    edges = np.diff(padded.ravel())
+    run_starts = np.flatnonzero(edges == 1)
+    run_lengths = np.flatnonzero(edges == -1) - run_starts
+    longest_streak = np.zeros(n_habits, dtype=np.int64)
+    np.maximum.at(longest_streak, run_starts // (n_days + 2), run_lengths)
+
+    # Current streak: completed days running through date_to, i.e. the position of the last miss from the end
+    reversed_grid = grid[:, ::-1]
+    current_streak = np.where(reversed_grid.all(axis=1), n_days, np.argmin(reversed_grid, axis=1))
+
+    # 1970-01-01 was a Thursday, (days since epoch + 3) % 7 gives Monday = 0
+    weekday = (days.astype(np.int64) + 3) % 7
+    weekdays = grid.astype(np.int64) @ (weekday[:, None] == np.arange(7)).astype(np.int64)
+
+    week_starts = np.flatnonzero((weekday == 0) | (np.arange(n_days) == 0))
+    weekly = np.add.reduceat(grid, week_starts, axis=1, dtype=np.int64)
+    months = days.astype("datetime64[M]")
+    month_starts = np.flatnonzero(np.r_[True, months[1:] != months[:-1]])
+    monthly = np.add.reduceat(grid, month_starts, axis=1, dtype=np.int64)
+    month_lengths = np.diff(np.r_[month_starts, n_days])
+
+    completed, longest_streak, current_streak = completed.tolist(), longest_streak.tolist(), current_streak.tolist()
+    week_labels = [str(day) for day in days[week_starts] - weekday[week_starts].astype("timedelta64[D]")]
+    month_labels = [str(month) for month in months[month_starts]]
+    return [{
+        "habit_id": habit_id,
+        "days": n_days,
+        "completed": completed[i],
+        "completion_rate": round(completed[i] / n_days, 4),
+        "longest_streak": longest_streak[i],
+        "current_streak": current_streak[i],
+        "weekdays": dict(zip(WEEKDAYS, weekdays[i].tolist())),
+        "weekly": [{"week": label, "completed": count} for label, count in zip(week_labels, weekly[i].tolist())],
+        "monthly": [
+            {"month": label, "completed": count, "completion_rate": round(count / length, 4)}
+            for label, count, length in zip(month_labels, monthly[i].tolist(), month_lengths.tolist())
+        ],
+    } for i, habit_id in enumerate(habit_ids)]
+
+
+async def _completed_dates_by_habit(user_id: str, date_from: str, date_to: str):
+    """Cursor over one document per habit, {_id: habit_id, dates: [completed YYYY-MM-DD dates in the range]}."""
+    if COMPLETION_STORAGE == "buckets":
+        return await completion_buckets_collection.aggregate([
+            {"$match": {"user_id": user_id, "month": {"$gte": date_from[:7], "$lte": date_to[:7]}}},
+            {"$project": {"habit_id": 1, "month": 1, "day": {"$objectToArray": "$days"}}},
+            {"$unwind": "$day"},
+            {"$match": {"day.v.c": True}},
+            {"$project": {"habit_id": 1, "date": {"$concat": ["$month", "-", "$day.k"]}}},
+            {"$match": {"date": {"$gte": date_from, "$lte": date_to}}},
+            {"$group": {"_id": "$habit_id", "dates": {"$push": "$date"}}},
+        ])
+    return await completions_collection.aggregate([
+        {"$match": {"user_id": user_id, "completed": True, "date": {"$gte": date_from, "$lte": date_to}}},
+        {"$group": {"_id": "$habit_id", "dates": {"$push": "$date"}}},
+    ])
+
+
+async def get_user_analytics(user_id: str, date_from: _date = None, date_to: _date = None):
+    """
+    Analytics for every habit of a user between date_from and date_to (inclusive).
+    Defaults to the 365 days ending today.
+    """
+    import numpy as np
+
+    date_to = date_to or _date.today()
+    date_from = date_from or date_to - timedelta(days=364)
+    if date_from > date_to:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="'from' must not be after 'to'.")
+    if (date_to - date_from).days + 1 > ANALYTICS_MAX_DAYS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Date range can't be longer than {ANALYTICS_MAX_DAYS} days.")
+
+    try:
+        habits_cursor = habits_collection.find(
+            {"user_id": user_id}, projection={"_id": 1, "name": 1}, sort=[("sort_index", -1)]
+        )
+        completions_cursor = await _completed_dates_by_habit(user_id, date_from.strftime("%Y-%m-%d"),
+                                                             date_to.strftime("%Y-%m-%d"))
+        habits, completions = await asyncio.gather(habits_cursor.to_list(), completions_cursor.to_list())
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail=f"An error occurred while loading completions: {str(e)}")
+
+    position = {habit["_id"]: i for i, habit in enumerate(habits)}
+    completions = [group for group in completions if group["_id"] in position]
+    habit_index = np.repeat(
+        np.array([position[group["_id"]] for group in completions], dtype=np.int64),
+        [len(group["dates"]) for group in completions],
+    )
+    completed_dates = np.array([day for group in completions for day in group["dates"]], dtype="datetime64[D]")
+
+    stats = habit_stats([habit["_id"] for habit in habits], habit_index, completed_dates, date_from, date_to)
+    for habit, habit_stat in zip(habits, stats):
+        habit_stat["name"] = habit.get("name")
+
+    return {"from": date_from, "to": date_to, "habits": stats}
@@ -0,0 +1,100 @@
+"""
+Analytics micro-benchmark: analytics.habit_stats (NumPy, all habits at once) against a naive per-habit Python
+loop over completion dicts, on synthetic data. No database needed:
+
+    python -m benchmarks.bench_analytics --habits 25 --days 365 --output analytics.json
+"""
+import argparse
+import random
+import timeit
+import uuid
+from datetime import date as _date, timedelta
+
+import numpy as np
+
+from analytics import habit_stats
+from benchmarks.common import write_report
+
+
+def make_completions(habit_ids, date_from: _date, days: int, rate: float):
+    rng = random.Random(0)
+    return [
+        {"habit_id": habit_id, "date": (date_from + timedelta(days=i)).strftime("%Y-%m-%d"), "completed": True}
+        for habit_id in habit_ids for i in range(days) if rng.random() < rate
+    ]
+
+
+def naive_stats(habit_ids, completions, date_from: _date, date_to: _date):
+    """Same numbers as habit_stats, computed the way get_user_habit_completion_streak walks completions."""
+    days = [date_from + timedelta(days=i) for i in range((date_to - date_from).days + 1)]
+    results = []
+    for habit_id in habit_ids:
+        done = {c["date"] for c in completions if c["habit_id"] == habit_id and c["completed"]}
+        flags = [day.strftime("%Y-%m-%d") in done for day in days]
+        longest = current = 0
+        for flag in flags:
+            current = current + 1 if flag else 0
+            longest = max(longest, current)
+        weekdays = [0] * 7
+        weekly, monthly = {}, {}
+        for day, flag in zip(days, flags):
+            weekdays[day.weekday()] += flag
+            week = day - timedelta(days=day.weekday())
+            weekly[week] = weekly.get(week, 0) + flag
+            monthly[(day.year, day.month)] = monthly.get((day.year, day.month), 0) + flag
+        results.append({
+            "habit_id": habit_id,
+            "completed": sum(flags),
+            "completion_rate": round(sum(flags) / len(days), 4),
+            "longest_streak": longest,
+            "current_streak": current,
+            "weekdays": weekdays,
+            "weekly": list(weekly.values()),
+            "monthly": list(monthly.values()),
+        })
+    return results
+
+
+def vectorized_stats(habit_ids, completions, date_from: _date, date_to: _date):
+    """Column conversion as get_user_analytics does it, then habit_stats."""
+    position = {habit_id: i for i, habit_id in enumerate(habit_ids)}
+    habit_index = np.fromiter((position[c["habit_id"]] for c in completions), dtype=np.int64, count=len(completions))
+    completed_dates = np.array([c["date"] for c in completions], dtype="datetime64[D]")
+    return habit_stats(habit_ids, habit_index, completed_dates, date_from, date_to)
+
+
+def measure(name, func, number, **sizes):
+    seconds = min(timeit.repeat(func, number=number, repeat=5)) / number
+    return {"name": name, **sizes, "ms_per_call": round(seconds * 1e3, 3)}
+
+
+def main(args):
+    date_to = _date.today()
+    date_from = date_to - timedelta(days=args.days - 1)
+    habit_ids = [str(uuid.uuid4()) for _ in range(args.habits)]
+    completions = make_completions(habit_ids, date_from, args.days, args.rate)
+
+    naive = naive_stats(habit_ids, completions, date_from, date_to)
+    vectorized = vectorized_stats(habit_ids, completions, date_from, date_to)
+    for expected, actual in zip(naive, vectorized):
+        for key in ("completed", "completion_rate", "longest_streak", "current_streak"):
+            assert expected[key] == actual[key], (key, expected[key], actual[key])
+        assert expected["weekdays"] == list(actual["weekdays"].values())
+        assert expected["weekly"] == [week["completed"] for week in actual["weekly"]]
+        assert expected["monthly"] == [month["completed"] for month in actual["monthly"]]
+
+    sizes = {"habits": args.habits, "days": args.days, "completions": len(completions)}
+    old = measure("naive loop", lambda: naive_stats(habit_ids, completions, date_from, date_to), args.number, **sizes)
+    new = measure("numpy", lambda: vectorized_stats(habit_ids, completions, date_from, date_to), args.number, **sizes)
+    new["speedup"] = round(old["ms_per_call"] / new["ms_per_call"], 1)
+    write_report({"results": [old, new]}, args.output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--habits", type=int, default=25)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--rate", type=float, default=0.7, help="share of days completed")
+    parser.add_argument("--number", type=int, default=5)
+    parser.add_argument("--output")
+    main(parser.parse_args())
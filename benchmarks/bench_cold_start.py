@@ -0,0 +1,70 @@
+"""
+Repeatable cold start benchmark: imports main.py in fresh interpreters and reports how long it takes.
+
+    python -m benchmarks.bench_cold_start --runs 20 --label lazy --output lazy.json
+
+Needs the usual environment variables (MONGO_URI, SECRET_KEY, ...). Set WARM_UP_ON_INIT=true to include the
+Mongo warm-up in the measurement. Run it on two commits and compare the reports; --top also lists the slowest
+modules from `python -X importtime`.
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.common import percentile, write_report
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|\s*(\S+)")
+
+
+def time_import(importtime: bool = False):
+    command = [sys.executable]
+    if importtime:
+        command += ["-X", "importtime"]
+    command += ["-c", "import main"]
+    started = time.perf_counter()
+    completed = subprocess.run(command, cwd=REPO_ROOT, capture_output=True, text=True)
+    elapsed = time.perf_counter() - started
+    if completed.returncode != 0:
+        raise SystemExit(completed.stderr)
+    return elapsed, completed.stderr
+
+
+def slowest_modules(importtime_output: str, top: int):
+    modules = []
+    for line in importtime_output.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, name = match.groups()
+            modules.append({"module": name, "self_ms": int(self_us) / 1000, "cumulative_ms": int(cumulative_us) / 1000})
+    return sorted(modules, key=lambda module: module["self_ms"], reverse=True)[:top]
+
+
+def main(args):
+    time_import()  # populate __pycache__ so every measured run compares like with like
+    runs = [time_import()[0] for _ in range(args.runs)]
+    report = {
+        "label": args.label,
+        "runs": args.runs,
+        "warm_up_on_init": os.getenv("WARM_UP_ON_INIT", "false"),
+        "median_ms": round(statistics.median(runs) * 1000, 2),
+        "p95_ms": round(percentile(runs, 95) * 1000, 2),
+        "min_ms": round(min(runs) * 1000, 2),
+        "max_ms": round(max(runs) * 1000, 2),
+    }
+    if args.top:
+        report["slowest_modules"] = slowest_modules(time_import(importtime=True)[1], args.top)
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--top", type=int, default=15, help="list the N slowest modules (0 to skip)")
+    parser.add_argument("--label", default="current")
+    parser.add_argument("--output")
+    main(parser.parse_args())
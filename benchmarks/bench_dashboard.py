@@ -0,0 +1,57 @@
+"""
+Dashboard latency: single aggregation (crud.get_user_dashboard_data) vs the previous two-query version.
+
+Talks to the database from config.py directly, no API server needed:
+
+    python -m benchmarks.bench_dashboard --user-id <user_id> --iterations 500 --output dashboard.json
+"""
+import argparse
+import asyncio
+from datetime import date as _date
+
+from benchmarks.common import drive, write_report
+
+
+async def two_query_dashboard(user_id: str):
+    """The implementation the aggregation replaced: habits find, then completions find with $in, merged in Python."""
+    from db import habits_collection, completions_collection
+
+    today_date = _date.today().strftime("%Y-%m-%d")
+    habits = await habits_collection.find(filter={"user_id": user_id, "archived": {"$ne": True}}).to_list()
+    habit_ids = [habit["_id"] for habit in habits]
+    completions = completions_collection.find(filter={"habit_id": {"$in": habit_ids}, "date": today_date},
+                                              projection={"habit_id": 1, "completed": 1, "_id": 0})
+    completion_map = {completion["habit_id"]: completion["completed"] async for completion in completions}
+    for habit in habits:
+        habit["completed"] = completion_map.get(habit["_id"], None)
+        habit["today_date"] = today_date
+    return habits
+
+
+async def main(args):
+    from crud import get_user_dashboard_data
+
+    async def two_queries(_):
+        await two_query_dashboard(args.user_id)
+
+    async def aggregation(_):
+        await get_user_dashboard_data(args.user_id)
+
+    # Warm the pool and the server caches before measuring
+    await two_query_dashboard(args.user_id)
+    await get_user_dashboard_data(args.user_id)
+
+    results = [
+        await drive("two queries (find + find $in)", two_queries, args.iterations, args.concurrency),
+        await drive("aggregation ($lookup)", aggregation, args.iterations, args.concurrency),
+    ]
+    write_report({"user_id": args.user_id, "concurrency": args.concurrency, "results": results}, args.output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user-id", required=True)
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=1, help="1 measures pure round trip latency")
+    parser.add_argument("--output")
+    asyncio.run(main(parser.parse_args()))
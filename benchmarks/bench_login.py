@@ -0,0 +1,58 @@
+"""
+Login throughput alongside mixed traffic.
+
+Start the API (uvicorn main:app --port 8000), then run:
+
+    python -m benchmarks.bench_login --user-id <user_id> --label pool --output pool.json
+
+A login user is registered on the first run. Logins run at the same time as dashboard reads, so the report shows
+both how fast /auth/token is and how much the bcrypt work slows down everything else. Compare runs with
+different PASSWORD_HASH_WORKERS / BCRYPT_ROUNDS settings.
+"""
+import argparse
+import asyncio
+
+import httpx
+
+from benchmarks.common import drive, write_report
+
+
+async def main(args):
+    limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=60) as client:
+        await client.post("/auth/register", json={
+            "first_name": "Bench",
+            "last_name": "Login",
+            "email": args.email,
+            "password": args.password,
+        })
+
+        async def login(_):
+            response = await client.post("/auth/token", data={"username": args.email, "password": args.password})
+            return response.status_code == 200
+
+        async def dashboard(_):
+            response = await client.get(f"/users/{args.user_id}/dashboard")
+            return response.status_code == 200
+
+        baseline = await drive("GET /users/{user_id}/dashboard (idle)", dashboard, args.requests, args.concurrency)
+        mixed = await asyncio.gather(
+            drive("POST /auth/token", login, args.logins, args.concurrency),
+            drive("GET /users/{user_id}/dashboard (during logins)", dashboard, args.requests, args.concurrency),
+        )
+
+    write_report({"label": args.label, "concurrency": args.concurrency, "results": [baseline, *mixed]}, args.output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--user-id", required=True, help="user whose dashboard is read as background traffic")
+    parser.add_argument("--email", default="bench-login@example.com")
+    parser.add_argument("--password", default="bench-login-password")
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--label", default="current")
+    parser.add_argument("--output")
+    asyncio.run(main(parser.parse_args()))
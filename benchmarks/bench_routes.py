@@ -0,0 +1,59 @@
+"""
+Before/after benchmark for the dashboard and upsert routes.
+
+Start the API (uvicorn main:app --port 8000) on the commit you want to measure, then run:
+
+    python -m benchmarks.bench_routes --user-id <user_id> --label async --output async.json
+
+Run it again against the old commit with a different --label and compare the two reports.
+"""
+import argparse
+import asyncio
+import random
+from datetime import date as _date, timedelta
+
+import httpx
+
+from benchmarks.common import drive, write_report
+
+
+async def main(args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=30) as client:
+        habits = (await client.get(f"/users/{args.user_id}/habits")).json()
+        habit_ids = [habit["_id"] for habit in habits]
+        if not habit_ids:
+            raise SystemExit(f"User {args.user_id} has no habits to benchmark against.")
+        today = _date.today()
+
+        async def dashboard(_):
+            response = await client.get(f"/users/{args.user_id}/dashboard")
+            return response.status_code == 200
+
+        async def upsert(i):
+            response = await client.put("/completions/upsert", json={
+                "user_id": args.user_id,
+                "habit_id": random.choice(habit_ids),
+                "date": str(today - timedelta(days=i % args.days)),
+                "completed": bool(i % 2),
+            })
+            return response.status_code == 201
+
+        results = [
+            await drive("GET /users/{user_id}/dashboard", dashboard, args.requests, args.concurrency),
+            await drive("PUT /completions/upsert", upsert, args.requests, args.concurrency),
+        ]
+
+    write_report({"label": args.label, "concurrency": args.concurrency, "results": results}, args.output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--user-id", required=True)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--days", type=int, default=7, help="spread upserts over this many past days")
+    parser.add_argument("--label", default="current")
+    parser.add_argument("--output")
+    asyncio.run(main(parser.parse_args()))
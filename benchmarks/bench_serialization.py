@@ -0,0 +1,95 @@
+"""
+Serialization micro-benchmarks for a realistic habit list and completion history.
+
+Compares the old read path (jsonable_encoder as crud.py ran it on reads, then FastAPI's response_model pass and
+JSONResponse) with MongoJSONResponse rendering the Mongo documents directly. No database needed:
+
+    python -m benchmarks.bench_serialization --habits 25 --days 365 --output serialization.json
+"""
+import argparse
+import timeit
+import uuid
+from datetime import date as _date, datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+
+from benchmarks.common import write_report
+from responses import MongoJSONResponse
+
+_list_adapter = TypeAdapter(list)
+
+
+def make_habits(count: int, user_id: str):
+    now = datetime.now()
+    return [{
+        "_id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "name": f"Habit {i}",
+        "description": "15 minutes of mindfulness meditation",
+        "sort_index": float(i),
+        "category": "Wellness",
+        "color": "#4287f5",
+        "icon": "meditation",
+        "start_date": "2025-02-25",
+        "end_date": None,
+        "archived": False,
+        "current_streak": i,
+        "longest_streak": 2 * i,
+        "last_completed_date": "2025-03-01",
+        "created_at": now,
+        "updated_at": now,
+    } for i in range(count)]
+
+
+def make_completions(days: int, user_id: str, habit_id: str):
+    today = _date.today()
+    return [{
+        "_id": str(uuid.uuid4()),
+        "habit_id": habit_id,
+        "user_id": user_id,
+        "date": (today - timedelta(days=i)).strftime("%Y-%m-%d"),
+        "completed": i % 3 != 0,
+        "timestamp": datetime.now(),
+    } for i in range(days)]
+
+
+def old_path(documents):
+    # crud.py jsonable_encoder, FastAPI response_model=list validate + serialize, JSONResponse.render
+    encoded = jsonable_encoder(documents)
+    content = _list_adapter.dump_python(_list_adapter.validate_python(encoded), mode="json")
+    return JSONResponse(content).body
+
+
+def new_path(documents):
+    return MongoJSONResponse(documents).body
+
+
+def measure(name, func, documents, number):
+    seconds = min(timeit.repeat(lambda: func(documents), number=number, repeat=5)) / number
+    return {"name": name, "documents": len(documents), "bytes": len(func(documents)), "us_per_call": round(seconds * 1e6, 2)}
+
+
+def main(args):
+    user_id = str(uuid.uuid4())
+    payloads = {
+        "habit list": make_habits(args.habits, user_id),
+        "completion history": make_completions(args.days, user_id, str(uuid.uuid4())),
+    }
+    results = []
+    for payload_name, documents in payloads.items():
+        old = measure(f"{payload_name}: jsonable_encoder + response_model", old_path, documents, args.number)
+        new = measure(f"{payload_name}: MongoJSONResponse (orjson)", new_path, documents, args.number)
+        new["speedup"] = round(old["us_per_call"] / new["us_per_call"], 1)
+        results += [old, new]
+    write_report({"results": results}, args.output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--habits", type=int, default=25)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--number", type=int, default=200)
+    parser.add_argument("--output")
+    main(parser.parse_args())
@@ -0,0 +1,69 @@
+import asyncio
+import json
+import time
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of floats (pct in 0-100)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def summarize(name, latencies, elapsed, errors=0):
+    """
+    Builds the machine readable result block for one benchmarked operation.
+    Latencies are in seconds, the report is in milliseconds.
+    """
+    return {
+        "name": name,
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 4),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "p50_ms": _ms(percentile(latencies, 50)),
+        "p95_ms": _ms(percentile(latencies, 95)),
+        "p99_ms": _ms(percentile(latencies, 99)),
+        "max_ms": _ms(max(latencies) if latencies else None),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+async def drive(name, make_call, total, concurrency):
+    """
+    Runs `make_call(i)` `total` times with at most `concurrency` calls in flight.
+    A call counts as an error when it raises or returns False.
+    """
+    latencies = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                ok = await make_call(i)
+            except Exception:
+                ok = False
+            if ok is False:
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(name, latencies, time.perf_counter() - started, errors)
+
+
+def write_report(report, output=None):
+    text = json.dumps(report, indent=2, default=str)
+    if output:
+        with open(output, "w") as f:
+            f.write(text)
+    print(text)
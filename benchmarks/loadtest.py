@@ -0,0 +1,329 @@
+"""
+Load test for every route in routes/, and /metrics when METRICS_ENABLED=true.
+
+Seeds a throwaway database with users, habits and days of completions, then drives each route concurrently
+through the FastAPI app from main.py (in-process over ASGI, or a running server with --base-url) and writes
+throughput and p50/p95/p99 latency per endpoint as JSON. Compare the reports of two branches to catch
+regressions, e.g. in the dashboard, upsert and prepare_completions hot paths.
+
+Needs a MongoDB to talk to; a local one is enough (docker run -p 27017:27017 mongo):
+
+    python -m benchmarks.loadtest --users 50 --habits 8 --days 90 --requests 500 --concurrency 50 --output main.json
+
+The other settings (SECRET_KEY, ALGORITHM, ...) come from the environment / .env as usual.
+"""
+import argparse
+import asyncio
+import os
+import random
+import uuid
+from datetime import date as _date, datetime, timedelta
+
+import httpx
+
+from benchmarks.common import drive, write_report
+
+PASSWORD = "loadtest-password"
+
+
+async def seed(args):
+    """Writes the fixture data directly to Mongo and returns the ids the scenarios pick from."""
+    from db import users_collection, habits_collection, completions_collection
+    from password_tools import get_password_hash
+
+    hashed_password = get_password_hash(PASSWORD)
+    today = _date.today()
+    users, habits, completions = [], [], []
+    for u in range(args.users):
+        user_id = str(uuid.uuid4())
+        users.append({"_id": user_id, "first_name": "Load", "last_name": f"Test {u}",
+                      "email": f"loadtest-{u}@example.com", "hashed_password": hashed_password})
+        for h in range(args.habits):
+            habit_id = str(uuid.uuid4())
+            habits.append({"_id": habit_id, "user_id": user_id, "name": f"Habit {h}", "sort_index": float(h),
+                           "archived": False, "current_streak": 0, "longest_streak": 0, "last_completed_date": None,
+                           "start_date": (today - timedelta(days=args.days)).strftime("%Y-%m-%d")})
+            for d in range(args.days):
+                completions.append({"_id": str(uuid.uuid4()), "habit_id": habit_id, "user_id": user_id,
+                                    "date": (today - timedelta(days=d)).strftime("%Y-%m-%d"),
+                                    "completed": random.random() < 0.6, "timestamp": datetime.now()})
+
+    await users_collection.insert_many(users)
+    await habits_collection.insert_many(habits)
+    for start in range(0, len(completions), 10000):
+        await completions_collection.insert_many(completions[start:start + 10000], ordered=False)
+
+    return {
+        "users": [user["_id"] for user in users],
+        "emails": [user["email"] for user in users],
+        "habits": [(habit["user_id"], habit["_id"]) for habit in habits],
+        "user_habits": {user["_id"]: [habit["_id"] for habit in habits if habit["user_id"] == user["_id"]]
+                        for user in users},
+        "completions": [completion["_id"] for completion in completions[:5000]],
+    }
+
+
+def scenarios(ctx, days):
+    """(endpoint, share of --requests, call) for every route; calls return True when the status is as expected."""
+    from config import METRICS_ENABLED
+
+    today = _date.today()
+
+    def some_habit():
+        return random.choice(ctx["habits"])
+
+    def some_date():
+        return str(today - timedelta(days=random.randrange(days)))
+
+    async def register(client, i):
+        r = await client.post("/auth/register", json={"first_name": "Load", "last_name": "Register",
+                                                      "email": f"register-{uuid.uuid4()}@example.com", "password": PASSWORD})
+        return r.status_code == 200
+
+    async def token(client, i):
+        r = await client.post("/auth/token", data={"username": random.choice(ctx["emails"]), "password": PASSWORD})
+        return r.status_code == 200
+
+    async def me(client, i):
+        r = await client.get("/auth/users/me", headers={"Authorization": f"Bearer {random.choice(ctx['tokens'])}"})
+        return r.status_code == 200
+
+    async def my_items(client, i):
+        r = await client.get("/auth/users/me/items", headers={"Authorization": f"Bearer {random.choice(ctx['tokens'])}"})
+        return r.status_code == 200
+
+    async def principal_cache(client, i):
+        r = await client.get("/auth/principal_cache", headers={"Authorization": f"Bearer {random.choice(ctx['tokens'])}"})
+        return r.status_code == 200
+
+    async def create_user(client, i):
+        r = await client.post("/users", json={"first_name": "Load", "last_name": "Create",
+                                             "email": f"create-{uuid.uuid4()}@example.com", "password": PASSWORD})
+        ctx["scratch_users"].append(r.json().get("id"))
+        return r.status_code == 201
+
+    async def get_user(client, i):
+        return (await client.get(f"/users/{random.choice(ctx['users'])}")).status_code == 200
+
+    async def update_user(client, i):
+        r = await client.patch(f"/users/{random.choice(ctx['users'])}", json={"first_name": f"Load {i}"})
+        return r.status_code == 200
+
+    async def delete_user(client, i):
+        if not ctx["scratch_users"]:
+            return False
+        r = await client.delete(f"/users/{ctx['scratch_users'].pop()}")
+        ctx["jobs"].append(r.json().get("job_id"))
+        return r.status_code == 202
+
+    async def reorder_habits(client, i):
+        user_id = random.choice(ctx["users"])
+        habit_ids = random.sample(ctx["user_habits"][user_id], len(ctx["user_habits"][user_id]))
+        return (await client.put(f"/users/{user_id}/habits/order", json=habit_ids)).status_code == 200
+
+    async def user_habits(client, i):
+        return (await client.get(f"/users/{random.choice(ctx['users'])}/habits")).status_code == 200
+
+    async def habit_completions(client, i):
+        user_id, habit_id = some_habit()
+        return (await client.get(f"/users/{user_id}/habits/{habit_id}")).status_code == 200
+
+    async def habit_completions_stream(client, i):
+        user_id, habit_id = some_habit()
+        return (await client.get(f"/users/{user_id}/habits/{habit_id}/stream")).status_code == 200
+
+    async def streak(client, i):
+        user_id, habit_id = some_habit()
+        return (await client.get(f"/users/{user_id}/habits/{habit_id}/completion_streak")).status_code == 200
+
+    async def dashboard(client, i):
+        return (await client.get(f"/users/{random.choice(ctx['users'])}/dashboard")).status_code == 200
+
+    async def heatmap(client, i):
+        return (await client.get(f"/users/{random.choice(ctx['users'])}/heatmap")).status_code == 200
+
+    async def analytics(client, i):
+        return (await client.get(f"/users/{random.choice(ctx['users'])}/analytics")).status_code == 200
+
+    async def export(client, i):
+        user_id = random.choice(ctx["users"])
+        r = await client.get(f"/users/{user_id}/export")
+        ctx["exports"][user_id] = r.content
+        return r.status_code == 200
+
+    async def import_(client, i):
+        # Imports a user's own export back into them: every row is an upsert of data that is already there
+        if not ctx["exports"]:
+            return False
+        user_id, body = random.choice(list(ctx["exports"].items()))
+        r = await client.post(f"/users/{user_id}/import", content=body)
+        return r.status_code == 200 and not r.json()["failed"]
+
+    async def create_habit(client, i):
+        user_id = random.choice(ctx["users"])
+        r = await client.post("/habits", json={"user_id": user_id, "name": "Load", "sort_index": 0})
+        if r.status_code != 201:
+            return False
+        ctx["scratch_habits"].append((user_id, r.json()["id"]))
+        ctx["user_habits"][user_id].append(r.json()["id"])
+        return True
+
+    async def get_habit(client, i):
+        return (await client.get(f"/habits/{some_habit()[1]}")).status_code == 200
+
+    async def update_habit(client, i):
+        return (await client.patch(f"/habits/{some_habit()[1]}", json={"description": f"edit {i}"})).status_code == 200
+
+    async def move_habit(client, i):
+        user_id = random.choice(ctx["users"])
+        if len(ctx["user_habits"][user_id]) < 2:
+            return False
+        habit_id, above_id = random.sample(ctx["user_habits"][user_id], 2)
+        return (await client.post(f"/habits/{habit_id}/move", json={"above_id": above_id})).status_code == 200
+
+    async def delete_habit(client, i):
+        if not ctx["scratch_habits"]:
+            return False
+        user_id, habit_id = ctx["scratch_habits"].pop()
+        ctx["user_habits"][user_id].remove(habit_id)
+        r = await client.delete(f"/habits/{habit_id}")
+        ctx["jobs"].append(r.json().get("job_id"))
+        return r.status_code == 202
+
+    async def get_job(client, i):
+        if not ctx["jobs"]:
+            return False
+        return (await client.get(f"/jobs/{random.choice(ctx['jobs'])}")).status_code == 200
+
+    async def prometheus_metrics(client, i):
+        return (await client.get("/metrics")).status_code == 200
+
+    async def create_completion(client, i):
+        user_id, habit_id = some_habit()
+        r = await client.post("/completions", json={"habit_id": habit_id, "user_id": user_id,
+                                                   "date": str(today + timedelta(days=1 + i)), "completed": True})
+        return r.status_code == 201
+
+    async def get_completion(client, i):
+        return (await client.get(f"/completions/{random.choice(ctx['completions'])}")).status_code == 200
+
+    async def update_completion(client, i):
+        r = await client.patch(f"/completions/{random.choice(ctx['completions'])}", json={"completed": bool(i % 2)})
+        return r.status_code == 200
+
+    async def upsert(client, i):
+        user_id, habit_id = some_habit()
+        r = await client.put("/completions/upsert", json={"user_id": user_id, "habit_id": habit_id,
+                                                         "date": some_date(), "completed": bool(i % 2)})
+        return r.status_code == 201
+
+    async def upsert_batch(client, i):
+        user_id, habit_id = some_habit()
+        items = [{"user_id": user_id, "habit_id": habit_id, "date": str(today - timedelta(days=d)), "completed": True}
+                 for d in range(7)]
+        return (await client.put("/completions/upsert/batch", json=items)).status_code == 200
+
+    async def prepare(client, i):
+        return (await client.post("/completions/prepare_completions")).status_code == 201
+
+    # Password routes are weighted down, they measure bcrypt more than anything else
+    endpoints = [
+        ("POST /auth/register", 0.05, register),
+        ("POST /auth/token", 0.05, token),
+        ("GET /auth/users/me", 1, me),
+        ("GET /auth/users/me/items", 0.2, my_items),
+        ("GET /auth/principal_cache", 0.2, principal_cache),
+        ("POST /users", 0.2, create_user),
+        ("GET /users/{user_id}", 1, get_user),
+        ("PATCH /users/{user_id}", 0.2, update_user),
+        ("DELETE /users/{user_id}", 0.2, delete_user),
+        ("GET /users/{user_id}/habits", 1, user_habits),
+        ("PUT /users/{user_id}/habits/order", 0.2, reorder_habits),
+        ("GET /users/{user_id}/habits/{habit_id}", 1, habit_completions),
+        ("GET /users/{user_id}/habits/{habit_id}/stream", 0.2, habit_completions_stream),
+        ("GET /users/{user_id}/habits/{habit_id}/completion_streak", 1, streak),
+        ("GET /users/{user_id}/dashboard", 1, dashboard),
+        ("GET /users/{user_id}/heatmap", 0.2, heatmap),
+        ("GET /users/{user_id}/analytics", 0.2, analytics),
+        ("GET /users/{user_id}/export", 0.05, export),
+        ("POST /users/{user_id}/import", 0.05, import_),
+        ("POST /habits", 0.2, create_habit),
+        ("GET /habits/{habit_id}", 1, get_habit),
+        ("PATCH /habits/{habit_id}", 0.2, update_habit),
+        ("POST /habits/{habit_id}/move", 0.2, move_habit),
+        ("DELETE /habits/{habit_id}", 0.2, delete_habit),
+        ("GET /jobs/{job_id}", 0.2, get_job),
+        ("POST /completions", 0.2, create_completion),
+        ("GET /completions/{completion_id}", 1, get_completion),
+        ("PATCH /completions/{completion_id}", 0.2, update_completion),
+        ("PUT /completions/upsert", 1, upsert),
+        ("PUT /completions/upsert/batch", 0.2, upsert_batch),
+        ("POST /completions/prepare_completions", 0.01, prepare),
+    ]
+    if METRICS_ENABLED:
+        endpoints.append(("GET /metrics", 0.2, prometheus_metrics))
+    return endpoints
+
+
+async def main(args):
+    os.environ["DATABASE_NAME"] = args.database
+    if args.mongo_uri:
+        os.environ["MONGO_URI"] = args.mongo_uri
+
+    from db import get_client
+    from main import app
+
+    ctx = await seed(args)
+    ctx["scratch_users"] = []
+    ctx["scratch_habits"] = []
+    ctx["jobs"] = []
+    ctx["exports"] = {}
+
+    if args.base_url:
+        transport, base_url = None, args.base_url
+    else:
+        transport, base_url = httpx.ASGITransport(app=app), "http://loadtest"
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    results = []
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url=base_url, limits=limits, timeout=60) as client:
+            tokens = []
+            for email in ctx["emails"][:10]:
+                r = await client.post("/auth/token", data={"username": email, "password": PASSWORD})
+                tokens.append(r.json()["access_token"])
+            ctx["tokens"] = tokens
+
+            for endpoint, share, call in scenarios(ctx, args.days):
+                if args.only and args.only not in endpoint:
+                    continue
+                total = max(1, int(args.requests * share))
+                results.append(await drive(endpoint, lambda i, call=call: call(client, i), total, args.concurrency))
+    finally:
+        if not args.keep:
+            await get_client().drop_database(args.database)
+
+    write_report({
+        "label": args.label,
+        "target": args.base_url or "in-process ASGI",
+        "seed": {"users": args.users, "habits_per_user": args.habits, "days": args.days},
+        "concurrency": args.concurrency,
+        "results": results,
+    }, args.output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-uri", default=os.getenv("LOADTEST_MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--database", default=f"habit_loadtest_{uuid.uuid4().hex[:8]}")
+    parser.add_argument("--base-url", help="drive a running server instead of the in-process app (it must use --database)")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--habits", type=int, default=8, help="habits per user")
+    parser.add_argument("--days", type=int, default=90, help="days of completion history per habit")
+    parser.add_argument("--requests", type=int, default=500, help="requests per read endpoint, writes get a share")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--only", help="only run endpoints containing this text")
+    parser.add_argument("--keep", action="store_true", help="keep the seeded database")
+    parser.add_argument("--label", default="current")
+    parser.add_argument("--output")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,191 @@
+"""
+Monthly bucketed completion storage, used when COMPLETION_STORAGE=buckets.
+
+One document per habit per month replaces up to 31 completion documents:
+
+    {"_id": "<habit_id>:2025-03", "habit_id": ..., "user_id": ..., "month": "2025-03",
+     "days": {"01": {"c": true, "t": <timestamp>}, "02": {"c": false, "t": <timestamp>}, ...}}
+
+`days` is keyed by the two digit day of the month rather than being a positional array, so a write is a
+single upserting $set of one key whether or not the bucket or the day exists yet. Completions read from buckets
+get the synthetic id "<habit_id>:<YYYY-MM-DD>", which get_completion/update_completion accept.
+"""
+import time
+from datetime import datetime
+
+from db import db, completions_collection, completion_buckets_collection, ASCENDING
+
+MIGRATION_ID = "completion_buckets"
+
+
+def bucket_id(habit_id: str, date: str):
+    return f"{habit_id}:{date[:7]}"
+
+
+def completion_id(habit_id: str, date: str):
+    return f"{habit_id}:{date}"
+
+
+def parse_completion_id(completion_id: str):
+    """(habit_id, date) of a synthetic completion id, or None for anything else (e.g. a plain uuid)."""
+    habit_id, _, date = completion_id.rpartition(":")
+    if not habit_id or len(date) != 10:
+        return None
+    return habit_id, date
+
+
+def set_day_op(habit_id: str, user_id: str, date: str, completed: bool, timestamp: datetime):
+    from pymongo import UpdateOne
+
+    return UpdateOne(
+        {"_id": bucket_id(habit_id, date)},
+        {
+            "$set": {f"days.{date[8:]}": {"c": completed, "t": timestamp}},
+            "$setOnInsert": {"habit_id": habit_id, "user_id": user_id, "month": date[:7]},
+        },
+        upsert=True,
+    )
+
+
+def unset_day_op(habit_id: str, date: str):
+    from pymongo import UpdateOne
+
+    return UpdateOne({"_id": bucket_id(habit_id, date)}, {"$unset": {f"days.{date[8:]}": ""}})
+
+
+def explode(bucket: dict, date_from: str | None = None, date_to: str | None = None, reverse: bool = False):
+    """The completions stored in a bucket as completion documents, in date order."""
+    completions = []
+    for day in sorted(bucket.get("days", {}), reverse=reverse):
+        date = f"{bucket['month']}-{day}"
+        if (date_from and date < date_from) or (date_to and date > date_to):
+            continue
+        value = bucket["days"][day]
+        completions.append({
+            "_id": completion_id(bucket["habit_id"], date),
+            "habit_id": bucket["habit_id"],
+            "user_id": bucket["user_id"],
+            "date": date,
+            "completed": value.get("c"),
+            "timestamp": value.get("t"),
+        })
+    return completions
+
+
+async def find_completions(query: dict, date_from: str | None = None, date_to: str | None = None,
+                           descending: bool = False, limit: int | None = None, completed_only: bool = False):
+    """
+    Yields the completions of the buckets matching `query` (habit_id/user_id) between two YYYY-MM-DD dates,
+    ordered by date.
+    """
+    month_filter = {}
+    if date_from:
+        month_filter["$gte"] = date_from[:7]
+    if date_to:
+        month_filter["$lte"] = date_to[:7]
+    if month_filter:
+        query = {**query, "month": month_filter}
+
+    buckets = completion_buckets_collection.find(query, sort=[("month", -1 if descending else 1)])
+    returned = 0
+    async for bucket in buckets:
+        for completion in explode(bucket, date_from, date_to, reverse=descending):
+            if completed_only and completion["completed"] is not True:
+                continue
+            yield completion
+            returned += 1
+            if limit and returned >= limit:
+                return
+
+
+def _day_unless_newer(day: str, value: dict):
+    """Expression for days.<day>: `value` when the bucket has no such day or an older one, else the stored day."""
+    stored = f"$days.{day}"
+    return {"$cond": [
+        {"$or": [{"$eq": [{"$ifNull": [stored, None]}, None]}, {"$lt": [f"{stored}.t", value["t"]]}]},
+        {"$literal": value},
+        stored,
+    ]}
+
+
+async def migrate_completions(chunk_size: int = 5000, restart: bool = False, max_chunks: int | None = None):
+    """
+    Copies the per-day completions collection into monthly buckets, `chunk_size` completions at a time in
+    (habit_id, user_id, date) order. After every chunk the last key is checkpointed in the `migrations`
+    collection, so an interrupted run picks up where it stopped; `restart` ignores the checkpoint.
+
+    Run it while the app still writes documents, switch COMPLETION_STORAGE to buckets, then run it once more
+    with `restart` to copy the writes made in between. A day is only written if its bucket doesn't have it yet
+    or has it with an older timestamp, so the re-run keeps what was written to the buckets after the switch.
+    With SPARSE_COMPLETIONS on, unchecking a day removes it from its bucket, and the re-run would copy the
+    day's old document back: stop writes from the switch until the re-run is done in that case. The completions
+    collection is left in place.
+    """
+    from pymongo import UpdateOne
+
+    migrations = db["migrations"]
+    state = None if restart else await migrations.find_one({"_id": MIGRATION_ID})
+    last = state["last"] if state else None
+    migrated = state["migrated"] if state else 0
+    chunks = 0
+    started = time.perf_counter()
+
+    while max_chunks is None or chunks < max_chunks:
+        query = {}
+        if last:
+            query = {"$or": [
+                {"habit_id": {"$gt": last["habit_id"]}},
+                {"habit_id": last["habit_id"], "user_id": {"$gt": last["user_id"]}},
+                {"habit_id": last["habit_id"], "user_id": last["user_id"], "date": {"$gt": last["date"]}},
+            ]}
+        chunk = await completions_collection.find(
+            query,
+            sort=[("habit_id", ASCENDING), ("user_id", ASCENDING), ("date", ASCENDING)],
+            limit=chunk_size,
+        ).to_list()
+        if not chunk:
+            break
+
+        # One pipeline update per bucket writing the days of the chunk it doesn't have a newer value for
+        updates = {}
+        for completion in chunk:
+            date = completion["date"]
+            fields = updates.setdefault(bucket_id(completion["habit_id"], date), {
+                "habit_id": {"$ifNull": ["$habit_id", completion["habit_id"]]},
+                "user_id": {"$ifNull": ["$user_id", completion["user_id"]]},
+                "month": {"$ifNull": ["$month", date[:7]]},
+            })
+            fields[f"days.{date[8:]}"] = _day_unless_newer(
+                date[8:], {"c": completion.get("completed"), "t": completion.get("timestamp")}
+            )
+        await completion_buckets_collection.bulk_write(
+            [UpdateOne({"_id": _id}, [{"$set": fields}], upsert=True) for _id, fields in updates.items()],
+            ordered=False,
+        )
+
+        last = {key: chunk[-1][key] for key in ("habit_id", "user_id", "date")}
+        migrated += len(chunk)
+        chunks += 1
+        await migrations.update_one(
+            {"_id": MIGRATION_ID},
+            {"$set": {"last": last, "migrated": migrated, "updated_at": datetime.now()}},
+            upsert=True,
+        )
+
+    done = max_chunks is None or chunks < max_chunks
+    return {
+        "migrated": migrated,
+        "chunks": chunks,
+        "elapsed_s": round(time.perf_counter() - started, 2),
+        "done": done,
+        "storage": await storage_stats() if done else None,
+    }
+
+
+async def storage_stats():
+    """Document count and index size of the per-day and the bucketed collections."""
+    stats = {}
+    for name in (completions_collection.name, completion_buckets_collection.name):
+        result = await db.command("collStats", name)
+        stats[name] = {"count": result.get("count", 0), "total_index_size": result.get("totalIndexSize", 0)}
+    return stats
@@ -0,0 +1,221 @@
+import logging
+import time
+from collections import OrderedDict
+from threading import Lock
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """
+    Bounded in-process cache. Entries expire `ttl` seconds after they are written and the least recently
+    used entry is evicted once `maxsize` is reached. Keeps hit/miss counters so the cache can be sized.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return entry[1] if entry else None
+
+    def discard_where(self, predicate):
+        """Removes every cached value matching `predicate`, returns how many were removed."""
+        with self._lock:
+            keys = [key for key, (_, value) in self._data.items() if predicate(value)]
+            for key in keys:
+                del self._data[key]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+class MemoryBackend:
+    """ReadCache backend keeping values in this process (a TTLCache), so each worker has its own copy."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        # key -> how many times it was invalidated, only needs to outlive the loads in flight
+        self._generations = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def get(self, key):
+        return self._cache.get(key)
+
+    async def generation(self, key):
+        return self._generations.get(key) or 0
+
+    async def set(self, key, value: bytes, generation):
+        if (self._generations.get(key) or 0) == generation:
+            self._cache.set(key, value)
+
+    async def delete(self, *keys):
+        for key in keys:
+            self._cache.pop(key)
+            self._generations.set(key, (self._generations.get(key) or 0) + 1)
+
+
+class RedisBackend:
+    """
+    ReadCache backend shared by every worker and Lambda instance. Needs the `redis` package; anything speaking the
+    Redis protocol works, so a local redis-server (or fakeredis) can stand in for the shared one.
+    """
+
+    def __init__(self, url: str, ttl: float):
+        self.url = url
+        self.ttl = ttl
+        self._client = None
+
+    @staticmethod
+    def _generation_key(key):
+        return f"generation:{key}"
+
+    def client(self):
+        if self._client is None:
+            import redis.asyncio as redis
+            self._client = redis.from_url(self.url)
+        return self._client
+
+    async def get(self, key):
+        return await self.client().get(key)
+
+    async def generation(self, key):
+        return await self.client().get(self._generation_key(key))
+
+    async def set(self, key, value: bytes, generation):
+        from redis.exceptions import WatchError
+
+        generation_key = self._generation_key(key)
+        async with self.client().pipeline(transaction=True) as pipe:
+            try:
+                # The SET only applies if no worker invalidated the key since `generation` was read
+                await pipe.watch(generation_key)
+                if await pipe.get(generation_key) != generation:
+                    return
+                pipe.multi()
+                pipe.set(key, value, ex=max(1, int(self.ttl)))
+                await pipe.execute()
+            except WatchError:
+                pass
+
+    async def delete(self, *keys):
+        async with self.client().pipeline(transaction=True) as pipe:
+            pipe.delete(*keys)
+            for key in keys:
+                pipe.incr(self._generation_key(key))
+                pipe.expire(self._generation_key(key), max(1, int(self.ttl)))
+            await pipe.execute()
+
+
+class ReadCache:
+    """
+    Read-through cache of JSON documents over a pluggable backend (get/set/delete of bytes). Values are stored
+    as orjson bytes. Keys are "<namespace>:<...>", and hits and misses are counted per namespace. A backend
+    error never fails a read: the value is loaded from the database instead.
+
+    Backends keep a generation per key that invalidate() bumps. A loaded value is only stored if the generation
+    is still the one read before loading, so a load racing with a write can't cache the value from before it.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = {}
+        self.misses = {}
+
+    async def get_or_load(self, key: str, load):
+        namespace = key.split(":", 1)[0]
+        try:
+            cached = await self.backend.get(key)
+        except Exception:
+            logger.warning("Read cache read failed for %s", key, exc_info=True)
+            cached = None
+        if cached is not None:
+            self.hits[namespace] = self.hits.get(namespace, 0) + 1
+            return orjson.loads(cached)
+
+        self.misses[namespace] = self.misses.get(namespace, 0) + 1
+        try:
+            generation = await self.backend.generation(key)
+        except Exception:
+            logger.warning("Read cache read failed for %s", key, exc_info=True)
+            return await load()
+        value = await load()
+        try:
+            await self.backend.set(key, orjson.dumps(value, default=str), generation)
+        except Exception:
+            logger.warning("Read cache write failed for %s", key, exc_info=True)
+        return value
+
+    async def invalidate(self, *keys):
+        try:
+            await self.backend.delete(*keys)
+        except Exception:
+            logger.warning("Read cache invalidation failed for %s", keys, exc_info=True)
+
+    def hit_ratio(self, namespace: str):
+        lookups = self.hits.get(namespace, 0) + self.misses.get(namespace, 0)
+        return round(self.hits.get(namespace, 0) / lookups, 4) if lookups else None
+
+    def stats(self):
+        return {
+            namespace: {
+                "hits": self.hits.get(namespace, 0),
+                "misses": self.misses.get(namespace, 0),
+                "hit_ratio": self.hit_ratio(namespace),
+            }
+            for namespace in sorted({*self.hits, *self.misses})
+        }
+
+
+def make_read_cache(backend: str, url: str, maxsize: int, ttl: float):
+    """ReadCache for READ_CACHE_BACKEND ("memory" or "redis"), None when caching is off."""
+    if backend == "memory":
+        return ReadCache(MemoryBackend(maxsize=maxsize, ttl=ttl))
+    if backend == "redis":
+        try:
+            import redis.asyncio  # noqa: F401
+        except ImportError:
+            raise RuntimeError("READ_CACHE_BACKEND=redis needs the redis package (pip install redis).") from None
+        return ReadCache(RedisBackend(url=url, ttl=ttl))
+    return None
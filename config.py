@@ -8,8 +8,96 @@ load_dotenv()
 MONGO_URI = os.getenv("MONGO_URI")
 DATABASE_NAME = os.getenv("DATABASE_NAME")
 
+# Connection pool (shared by every in-flight request on a worker)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "0")) or None
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "0")) or None
+
+# Sparse completions: only checked days are stored, a missing completion means "not completed"
+# (prepare_completions becomes a no-op and reads fill in the missing days)
+SPARSE_COMPLETIONS = os.getenv("SPARSE_COMPLETIONS", "false").lower() == "true"
+
+# Largest list accepted by PUT /completions/upsert/batch
+MAX_UPSERT_BATCH_SIZE = int(os.getenv("MAX_UPSERT_BATCH_SIZE", "500"))
+
+# POST /users/{user_id}/import: rows validated and bulk written per chunk, row errors listed in the report
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "1000"))
+IMPORT_MAX_REPORTED_ERRORS = int(os.getenv("IMPORT_MAX_REPORTED_ERRORS", "100"))
+
+# Completion history pagination (GET /users/{user_id}/habits/{habit_id})
+COMPLETION_PAGE_SIZE = int(os.getenv("COMPLETION_PAGE_SIZE", "366"))
+MAX_COMPLETION_PAGE_SIZE = int(os.getenv("MAX_COMPLETION_PAGE_SIZE", "1000"))
+
+# Set by the Lambda runtime
+ON_LAMBDA = bool(os.getenv("AWS_LAMBDA_FUNCTION_NAME"))
+# Open the Mongo connection ahead of the first request: during Lambda init on Lambda, at startup (lifespan) elsewhere
+WARM_UP_ON_INIT = os.getenv("WARM_UP_ON_INIT", "true" if ON_LAMBDA else "false").lower() == "true"
+
+# Request/Mongo instrumentation exposed on GET /metrics (Prometheus text format)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() == "true"
+
+# "documents": one completion document per habit per day, "buckets": one per habit per month (buckets.py).
+# Migrate existing completions with `python manage.py migrate-buckets` before switching.
+COMPLETION_STORAGE = os.getenv("COMPLETION_STORAGE", "documents").lower()
+
+# prepare_completions walks habits in batches of this size with this many batch writes in flight, and stops
+# (to be resumed by the next call) after the time budget, e.g. to fit a Lambda timeout
+PREPARE_BATCH_SIZE = int(os.getenv("PREPARE_BATCH_SIZE", "500"))
+PREPARE_CONCURRENCY = int(os.getenv("PREPARE_CONCURRENCY", "4"))
+PREPARE_TIME_BUDGET_SECONDS = float(os.getenv("PREPARE_TIME_BUDGET_SECONDS", "25"))
+
+# Read-through cache of habit lists and today's dashboards, invalidated by the writes in crud.py.
+# "none", "memory" (per process: other workers only see a write once the TTL runs out) or "redis" (shared)
+READ_CACHE_BACKEND = os.getenv("READ_CACHE_BACKEND", "none").lower()
+READ_CACHE_URL = os.getenv("READ_CACHE_URL", "redis://localhost:6379/0")
+READ_CACHE_MAXSIZE = int(os.getenv("READ_CACHE_MAXSIZE", "10000"))
+READ_CACHE_TTL_SECONDS = float(os.getenv("READ_CACHE_TTL_SECONDS", "300"))
+
+# Background jobs (cascading deletes): documents deleted per batch, and how long a job may go without progress
+# before another process takes it over
+JOB_BATCH_SIZE = int(os.getenv("JOB_BATCH_SIZE", "500"))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "60"))
+
+# Coalesce repeated upserts of the same completion and write them in bulk every few seconds (write-behind).
+# Buffered writes are lost if the process dies before a flush. Always off on Lambda: Mangum runs the lifespan
+# shutdown, which flushes the buffer, after every invocation, so there would be nothing to coalesce.
+COMPLETION_WRITE_BUFFER = os.getenv("COMPLETION_WRITE_BUFFER", "false").lower() == "true" and not ON_LAMBDA
+COMPLETION_WRITE_BUFFER_INTERVAL_SECONDS = float(os.getenv("COMPLETION_WRITE_BUFFER_INTERVAL_SECONDS", "2"))
+COMPLETION_WRITE_BUFFER_MAX_PENDING = int(os.getenv("COMPLETION_WRITE_BUFFER_MAX_PENDING", "500"))
+
+# Longest date range accepted by the analytics endpoint
+ANALYTICS_MAX_DAYS = int(os.getenv("ANALYTICS_MAX_DAYS", "1830"))
+
+# Token bucket rate limits as "<requests>/<seconds>" ("0" = unlimited): POST /auth/* per client IP, other
+# writes and reads per user (or IP without a valid token). Each process keeps its own buckets (ratelimit.py).
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "false").lower() == "true"
+RATE_LIMIT_AUTH = os.getenv("RATE_LIMIT_AUTH", "10/60")
+RATE_LIMIT_WRITE = os.getenv("RATE_LIMIT_WRITE", "120/60")
+RATE_LIMIT_READ = os.getenv("RATE_LIMIT_READ", "600/60")
+# Clients tracked per policy, the least recently seen are forgotten past this
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+# Requests handled at once when RATE_LIMIT_ENABLED (0 = no cap); a request waiting longer than
+# MAX_QUEUE_SECONDS for a slot is answered 503
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "100"))
+MAX_QUEUE_SECONDS = float(os.getenv("MAX_QUEUE_SECONDS", "2"))
+
+# Reconcile the indexes declared in indexes.py when the app starts, once per process (per container on Lambda)
+ENSURE_INDEXES_ON_STARTUP = os.getenv("ENSURE_INDEXES_ON_STARTUP", "false").lower() == "true"
+
 
 # Password
 SECRET_KEY=os.getenv("SECRET_KEY")
 ALGORITHM=os.getenv("ALGORITHM")
-ACCESS_TOKEN_EXPIRE_MINUTES=int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
\ No newline at end of file
+ACCESS_TOKEN_EXPIRE_MINUTES=int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
+
+# bcrypt work factor, existing hashes with a different cost are re-hashed on the next login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Processes used for hashing (0 = default thread pool, Lambda has no /dev/shm for process pools)
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "0" if os.getenv("AWS_LAMBDA_FUNCTION_NAME") else str(os.cpu_count() or 1)))
+# Queued + running hash/verify calls allowed before /auth routes answer 503
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+
+# Verified principals cached by get_current_user, per process: other processes see a deleted or changed user up to the TTL late (0 disables the cache)
+PRINCIPAL_CACHE_MAXSIZE = int(os.getenv("PRINCIPAL_CACHE_MAXSIZE", "10000"))
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "300"))
\ No newline at end of file
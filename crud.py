@@ -1,57 +1,169 @@
+import asyncio
+import base64
+import calendar
+import codecs
+import csv
+import time
 import uuid
 from pprint import pprint
 
 from fastapi import HTTPException, status, Depends
 from fastapi.encoders import jsonable_encoder
-from pymongo import DESCENDING, UpdateOne
-from pymongo.errors import DuplicateKeyError
+from pydantic import ValidationError
 from datetime import date as _date
 from datetime import timedelta, datetime
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from jwt.exceptions import InvalidTokenError
 from typing import Annotated
-
-
-from db import users_collection, habits_collection, completions_collection
-from password_tools import verify_password, create_access_token, decode_token, oauth2_scheme, get_password_hash
+import orjson
+
+
+import buckets
+import jobs
+from cache import TTLCache, make_read_cache
+from responses import make_etag
+from config import PRINCIPAL_CACHE_MAXSIZE, PRINCIPAL_CACHE_TTL_SECONDS, SPARSE_COMPLETIONS, MAX_UPSERT_BATCH_SIZE
+from config import COMPLETION_PAGE_SIZE, MAX_COMPLETION_PAGE_SIZE, COMPLETION_STORAGE
+from config import IMPORT_CHUNK_SIZE, IMPORT_MAX_REPORTED_ERRORS
+from config import JOB_BATCH_SIZE
+from config import READ_CACHE_BACKEND, READ_CACHE_URL, READ_CACHE_MAXSIZE, READ_CACHE_TTL_SECONDS
+from config import PREPARE_BATCH_SIZE, PREPARE_CONCURRENCY, PREPARE_TIME_BUDGET_SECONDS
+from config import COMPLETION_WRITE_BUFFER, COMPLETION_WRITE_BUFFER_INTERVAL_SECONDS, COMPLETION_WRITE_BUFFER_MAX_PENDING
+from db import users_collection, habits_collection, completions_collection, completion_bitmaps_collection
+from db import completion_buckets_collection, jobs_collection, ASCENDING, DESCENDING
+from write_buffer import WriteBuffer
+from metrics import background_context
+from password_tools import create_access_token, decode_token, oauth2_scheme
+from password_tools import get_password_hash_async, verify_and_update_password_async
 from models import TokenData
 from models import User, UserCreate, UserUpdate
-from models import HabitCreate, HabitUpdate
+from models import HabitCreate, HabitUpdate, HabitMove
 from models import CompletionCreate, CompletionUpdate, CompletionUpsert
 
 
+# Checkpoint document of the prepare_completions job in the jobs collection
+PREPARE_JOB_ID = "prepare_completions"
+
+# Completions stored as one document per habit per month (buckets.py) instead of one per day
+BUCKETED_COMPLETIONS = COMPLETION_STORAGE == "buckets"
+
+# Verified users keyed by token subject (email), saves a users lookup on most authenticated requests. The cache
+# is per process: this process drops an entry when it updates or deletes the user, but a user deleted or changed
+# through another worker or Lambda instance stays authenticated here, as they were, for up to the TTL.
+principal_cache = TTLCache(maxsize=PRINCIPAL_CACHE_MAXSIZE, ttl=PRINCIPAL_CACHE_TTL_SECONDS)
+
+
+def invalidate_principal(user_id: str):
+    principal_cache.discard_where(lambda user: user.id == user_id)
+
+
+# Habit lists ("habits:<user_id>") and dashboards ("dashboard:<user_id>:<YYYY-MM-DD>", only the current day),
+# None when READ_CACHE_BACKEND is "none"
+read_cache = make_read_cache(READ_CACHE_BACKEND, READ_CACHE_URL, READ_CACHE_MAXSIZE, READ_CACHE_TTL_SECONDS)
+
+
+async def invalidate_user_reads(user_id: str, *days: str):
+    """Drops a user's cached habit list and dashboards (today's and those of `days`) after a write."""
+    if read_cache is not None:
+        dates = {_date.today().strftime("%Y-%m-%d"), *(str(day)[:10] for day in days)}
+        await read_cache.invalidate(f"habits:{user_id}", *(f"dashboard:{user_id}:{date}" for date in dates))
+
+
+# ----------------------
+# Versions
+# ----------------------
+# Users and habits carry a `version` that every write increments (and `updated_at`), so conditional GETs can be
+# answered from a projection of just these fields.
+VERSION_FIELDS = {"_id": 1, "version": 1}
+
+
+def _versioned(update: dict):
+    """Adds the version bump to an update document."""
+    return {**update, "$inc": {"version": 1}, "$set": {**update.get("$set", {}), "updated_at": datetime.now()}}
+
+
+def versions_etag(documents: list[dict], *extra):
+    """Strong ETag of a list of versioned documents (ids, versions and order) plus any `extra` parts."""
+    return make_etag([[document["_id"], document.get("version", 0)] for document in documents], *extra)
+
+
+# ----------------------
+# Field selection
+# ----------------------
+def field_projection(fields: str | None, model, required=("_id",)):
+    """
+    Mongo projection for a `fields=` query parameter (comma separated names of `model`'s fields, "id" or "_id"
+    for the id), always including the `required` fields. None when no fields are asked for.
+    Unknown names are a 400.
+    """
+    if not fields:
+        return None
+    names = {}
+    for name, field in model.model_fields.items():
+        if not field.exclude:
+            names[name] = names[field.alias or name] = field.alias or name
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in names]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(sorted(set(names.values())))}.",
+        )
+    return {field: 1 for field in (*required, *(names[field] for field in requested))}
+
+
+def _project(document: dict, projection: dict | None):
+    """Applies a projection to a document built outside Mongo (bucket completions, sparse placeholders)."""
+    if projection is None:
+        return document
+    return {key: value for key, value in document.items() if key in projection}
+
+
 # ----------------------
 # User Auth Operations
 # ----------------------
-def register_user(user_form: UserCreate):
+async def register_user(user_form: UserCreate):
     user_data = {
         **user_form.model_dump(exclude={"password"}, by_alias=True),
-        "hashed_password": get_password_hash(user_form.password)
+        "hashed_password": await get_password_hash_async(user_form.password),
+        "version": 1,
+        "updated_at": datetime.now(),
     }
     user_data_json = jsonable_encoder(user_data)
-    result = users_collection.insert_one(user_data_json)
+    result = await users_collection.insert_one(user_data_json)
     return {"id": str(result.inserted_id)}
 
 
 
 
 
-def authenticate_user(email: str, password: str):
+async def authenticate_user(email: str, password: str):
     """
     uses user email and password to fetch user details (including _id)
     :param email:
     :param password:
     :return:
     """
-    user = get_user_by_email(email=email)
+    user = await get_user_by_email(email=email)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    valid, new_hash = await verify_and_update_password_async(password, user.hashed_password)
+    if not valid:
         return False
+    if new_hash:
+        # Stored hash used an old work factor, replace it while we have the plain password
+        await users_collection.update_one({"_id": user.id}, _versioned({"$set": {"hashed_password": new_hash}}))
+        invalidate_principal(user.id)
     return user
 
 
-def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
-    """Extracts the user from a JWT token without OAuth2 dependency."""
+async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
+    """
+    Extracts the user from a JWT token without OAuth2 dependency.
+
+    Users are served from principal_cache for up to PRINCIPAL_CACHE_TTL_SECONDS (default 300s), so a user deleted
+    or changed by another worker or Lambda instance stays authenticated with their old data for up to that long.
+    """
 
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -67,25 +179,34 @@ def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
         token_data = TokenData(email=email)
     except InvalidTokenError:
         raise credentials_exception
-    user = get_user_by_email(email=token_data.email)
+
+    user = principal_cache.get(token_data.email)
+    if user is not None:
+        return user
+
+    user = await get_user_by_email(email=token_data.email)
     if user is None:
         raise credentials_exception
+    principal_cache.set(token_data.email, user)
     return user
 
 
 # ----------------------
 # User CRUD Operations
 # ----------------------
-def create_user(user: UserCreate):
+async def create_user(user: UserCreate):
     # Convert the Pydantic model to a JSON-serializable dict.
+    from pymongo.errors import DuplicateKeyError
+
     user_data = jsonable_encoder(user)
 
     # Rename the key "password" to "hashed_password"
     if "password" in user_data:
         user_data["hashed_password"] = user_data.pop("password")
+    user_data.update({"version": 1, "updated_at": datetime.now()})
 
     try:
-        result = users_collection.insert_one(user_data)
+        result = await users_collection.insert_one(user_data)
         # Convert ObjectId to string before returning
         return {"id": str(result.inserted_id)}
     except DuplicateKeyError:
@@ -94,34 +215,34 @@ def create_user(user: UserCreate):
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An error occurred: {str(e)}")
 
 
-def get_user(user_id: str):
+async def get_user(user_id: str, projection: dict | None = None):
     try:
         # Retrieve the user document from the collection.
-        user = users_collection.find_one({"_id": user_id})
+        user = await users_collection.find_one({"_id": user_id}, projection=projection or {"hashed_password": 0})
         if user is None:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found.")
-        return jsonable_encoder(user)
+        return user
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An error occurred while fetching the user: {str(e)}")
 
 
-def get_user_by_email(email: str):
+async def get_user_by_email(email: str):
     try:
         # Retrieve the user document from the collection.
-        user_data = users_collection.find_one({"email": email})
+        user_data = await users_collection.find_one({"email": email})
         if user_data is None:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found.")
 
         # Convert ObjectId to string
         user_data["_id"] = str(user_data["_id"])
 
-        return User(**jsonable_encoder(user_data))
+        return User.model_validate(user_data)
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An error occurred while fetching the user: {str(e)}")
 
 
 
-def update_user(user_id: str, user: UserUpdate):
+async def update_user(user_id: str, user: UserUpdate):
     # Convert the Pydantic model to a dict, excluding fields that were not provided
     update_data = user.model_dump(exclude_unset=True)
     if not update_data:
@@ -129,21 +250,31 @@ def update_user(user_id: str, user: UserUpdate):
 
     try:
         # Perform the update using the $set operator to update only provided fields.
-        result = users_collection.update_one({"_id": user_id}, {"$set": update_data})
+        result = await users_collection.update_one({"_id": user_id}, _versioned({"$set": update_data}))
+        invalidate_principal(user_id)
         if result.matched_count == 0:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found.")
-        return users_collection.find_one({"_id": user_id})
+        return await users_collection.find_one({"_id": user_id}, projection={"hashed_password": 0})
 
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="An error occurred while updating the user.")
 
 
-def delete_user(user_id: str):
+async def delete_user(user_id: str):
+    """Deletes the user now and their habits, completions and derived documents in a background job."""
     try:
-        result = users_collection.delete_one({"_id": user_id})
+        result = await users_collection.delete_one({"_id": user_id})
+        invalidate_principal(user_id)
         if result.deleted_count == 0:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found.")
-        return {"message": "User deleted successfully."}
+        if completion_write_buffer is not None:
+            completion_write_buffer.discard_where(lambda key: key[1] == user_id)
+        await invalidate_user_reads(user_id)
+        job = await jobs.start_job("delete_user", user_id)
+        return {"message": "User deleted successfully, their habits are being removed.", "job_id": job["_id"],
+                "status": job["status"]}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error deleting user: {str(e)}")
@@ -152,21 +283,22 @@ def delete_user(user_id: str):
 # ----------------------
 # Habit CRUD Operations
 # ----------------------
-def create_habit(habit: HabitCreate):
+async def create_habit(habit: HabitCreate):
+    from pymongo.errors import DuplicateKeyError
+
     habit_data = jsonable_encoder(habit)
 
-    # Find the current highest sort_index
-    max_sort_index = habits_collection.find_one(
-        filter={"user_id": habit_data["user_id"]},
-        sort=[("sort_index", DESCENDING)],
-        projection={"sort_index": 1}
-    )
-    # Determine new sort_index
-    highest_sort_index = max_sort_index.get("sort_index", 0) if max_sort_index else 0
-    habit_data["sort_index"] = highest_sort_index + 1  # Ensure it's the highest
+    # New habits go on top. The creation time is above every index handed out before it (rebalanced indexes are
+    # 1..n), so no read of the current highest sort_index is needed.
+    habit_data["sort_index"] = time.time()
+
+    # Streak counters, kept up to date by every completion write
+    habit_data.update({"current_streak": 0, "longest_streak": 0, "last_completed_date": None})
+    habit_data.update({"version": 1, "updated_at": datetime.now()})
 
     try:
-        result = habits_collection.insert_one(habit_data)
+        result = await habits_collection.insert_one(habit_data)
+        await invalidate_user_reads(habit_data["user_id"])
         # Convert ObjectId to string before returning
         return {"id": str(result.inserted_id)}
     except DuplicateKeyError:
@@ -175,83 +307,278 @@ def create_habit(habit: HabitCreate):
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="An error occurred while creating the habit.")
 
 
-def get_user_habits(user_id: str):
+async def get_user_habits(user_id: str, projection: dict | None = None):
     # Returns list of dict objects
-    try:
+    async def load():
         habits = habits_collection.find(
             filter={"user_id": user_id},
+            projection=projection,
             sort=[("sort_index", DESCENDING)],
         )
-        return list(habits)
+        return await habits.to_list()
+
+    try:
+        if read_cache is not None and projection is None:
+            return await read_cache.get_or_load(f"habits:{user_id}", load)
+        return await load()
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="An error occurred while fetching the user's habits.")
 
 
-def get_user_dashboard_data(user_id: str):
+# Habit fields the dashboard renders, everything else stays in Mongo
+DASHBOARD_FIELDS = ("_id", "user_id", "name", "description", "sort_index", "category", "color", "icon",
+                    "current_streak", "longest_streak", "last_completed_date", "version")
+
+
+def _dashboard_completion_lookup(user_id: str, today_date: str):
+    """$lookup joining the day's completion (as `completion: [{completed}]`) from the configured storage."""
+    if BUCKETED_COMPLETIONS:
+        # Served by the (habit_id, month) bucket index
+        return {"$lookup": {
+            "from": completion_buckets_collection.name,
+            "localField": "_id",
+            "foreignField": "habit_id",
+            "pipeline": [
+                {"$match": {"month": today_date[:7]}},
+                {"$project": {"_id": 0, "completed": f"$days.{today_date[8:]}.c"}},
+                {"$limit": 1},
+            ],
+            "as": "completion",
+        }}
+    # Served by the (habit_id, user_id, date) index: every habit joined belongs to `user_id`, so matching it as a
+    # constant gives the index all three fields instead of only its habit_id prefix
+    return {"$lookup": {
+        "from": completions_collection.name,
+        "localField": "_id",
+        "foreignField": "habit_id",
+        "pipeline": [
+            {"$match": {"user_id": user_id, "date": today_date}},
+            {"$project": {"_id": 0, "completed": 1}},
+            {"$limit": 1},
+        ],
+        "as": "completion",
+    }}
+
+
+async def get_user_dashboard_data(user_id: str, day: _date | None = None, projection: dict | None = None):
     """
-    Retrieves all active habits (not archived) for a given user_id and fetches their completion values for today's date.
+    Retrieves all active habits (not archived) for a given user_id with their completion value for `day`
+    (defaults to today), in a single aggregation.
 
-    Make sure to run prepare_completions at least once a day to avoid null completed values.
+    Make sure to run prepare_completions at least once a day to avoid null completed values
+    (not needed with SPARSE_COMPLETIONS, where a missing completion reads as False).
     :param user_id:
+    :param day:
+    :param projection: DashboardHabit fields to return (see field_projection), all of them when None
     :return:
     """
-    today_date = _date.today().strftime("%Y-%m-%d")
-
-    # Fetch all habits that are not archived for the given user_id
-    habits = list(habits_collection.find(filter={"user_id": user_id, "archived": {"$ne": True}}))
-
-    habit_ids = [habit["_id"] for habit in habits]
-
+    today_date = (day or _date.today()).strftime("%Y-%m-%d")
+    missing_value = False if SPARSE_COMPLETIONS else None
+
+    computed = {
+        "completed": {"$ifNull": [{"$arrayElemAt": ["$completion.completed", 0]}, missing_value]},
+        "today_date": {"$literal": today_date},
+        # A streak that doesn't run through the day is over (see get_user_habit_completion_streak)
+        "current_streak": {"$cond": [
+            {"$gte": [{"$ifNull": ["$last_completed_date", ""]}, today_date]}, "$current_streak", 0,
+        ]},
+    }
+    if projection is not None:
+        computed = {field: value for field, value in computed.items() if field in projection}
+    fields = [field for field in DASHBOARD_FIELDS
+              if field not in computed and (projection is None or field in projection)]
+
+    pipeline = [
+        {"$match": {"user_id": user_id, "archived": {"$ne": True}}},
+        {"$sort": {"sort_index": DESCENDING}},
+        # The completion join is skipped when `completed` isn't asked for
+        *([_dashboard_completion_lookup(user_id, today_date)] if "completed" in computed else []),
+        {"$project": {**{field: 1 for field in fields}, **computed}},
+    ]
+
+    async def load():
+        habits = await habits_collection.aggregate(pipeline)
+        return await habits.to_list()
 
-    # Fetch today's completions for the retrieved habit_ids
-    completions = completions_collection.find(filter={"habit_id": {"$in": habit_ids}, "date": today_date},
-                                      projection={"habit_id": 1, "completed": 1, "_id": 0})
+    try:
+        if read_cache is not None and projection is None and today_date == _date.today().strftime("%Y-%m-%d"):
+            habits = await read_cache.get_or_load(f"dashboard:{user_id}:{today_date}", load)
+        else:
+            habits = await load()
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail="An error occurred while fetching the dashboard.")
 
+    if completion_write_buffer is not None and len(completion_write_buffer) and "completed" in computed:
+        # Show toggles that are still waiting in the write buffer
+        for habit in habits:
+            pending = completion_write_buffer.get((habit["_id"], user_id, today_date))
+            if pending is not None:
+                habit["completed"] = pending.completed
+    return habits
 
-    completion_map = {completion["habit_id"]: completion["completed"] for completion in completions}
 
-    # Attach completion values and date to habits
-    for habit in habits:
-        habit["completed"] = completion_map.get(habit["_id"], None)
-        habit["today_date"] = today_date
+def dashboard_etag(user_id: str, habits: list[dict], day: _date | None = None, *extra):
+    """
+    ETag of a dashboard. Completion writes bump their habit's version, so habit versions and the day cover the
+    rendered data; toggles still waiting in the write buffer and any `extra` parts (e.g. the selected fields)
+    are added on top.
+    """
+    today_date = (day or _date.today()).strftime("%Y-%m-%d")
+    pending = []
+    if completion_write_buffer is not None and len(completion_write_buffer):
+        for habit in habits:
+            request = completion_write_buffer.get((habit["_id"], user_id, today_date))
+            pending.append(None if request is None else request.completed)
+    return versions_etag(habits, today_date, pending, *extra)
 
-    return habits
 
+async def get_user_dashboard_etag(user_id: str, day: _date | None = None, *extra):
+    """dashboard_etag from the habits' versions only, without running the dashboard aggregation."""
+    try:
+        habits = habits_collection.find(
+            {"user_id": user_id, "archived": {"$ne": True}}, projection=VERSION_FIELDS,
+            sort=[("sort_index", DESCENDING)],
+        )
+        return dashboard_etag(user_id, await habits.to_list(), day, *extra)
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail="An error occurred while fetching the dashboard.")
 
 
-def get_habit(habit_id: str):
+async def get_habit(habit_id: str, projection: dict | None = None):
     try:
-        habit = habits_collection.find_one(
+        habit = await habits_collection.find_one(
             filter={"_id": habit_id},
+            projection=projection,
             # sort=[("sort_index", DESCENDING)],
         )
-        return jsonable_encoder(habit)
+        return habit
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail="An error occurred while fetching the habit.")
 
 
-def update_habit(habit_id: str, habit: HabitUpdate):
+async def update_habit(habit_id: str, habit: HabitUpdate):
     update_data = habit.model_dump(exclude_unset=True)
     if not update_data:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No update data provided.")
 
     try:
-        result = habits_collection.update_one({"_id": habit_id}, {"$set": update_data})
+        result = await habits_collection.update_one({"_id": habit_id}, _versioned({"$set": update_data}))
         if result.matched_count == 0:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Habit not found.")
-        return habits_collection.find_one({"_id": habit_id})
+        habit = await habits_collection.find_one({"_id": habit_id})
+        await invalidate_user_reads(habit["user_id"])
+        return habit
 
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="An error occurred while updating the habit.")
 
 
-def delete_habit(habit_id: str):
+# Gaps between neighbouring sort_index values smaller than this trigger a rebalance before a move
+MIN_SORT_INDEX_GAP = 1e-6
+
+
+async def rebalance_sort_indexes(user_id: str):
+    """Respaces a user's habits to sort_index n..1 (top to bottom) without changing their order."""
+    habits = habits_collection.find({"user_id": user_id}, projection={"_id": 1}, sort=[("sort_index", DESCENDING)])
+    habit_ids = [habit["_id"] async for habit in habits]
+    await _write_habit_order(user_id, habit_ids)
+    return len(habit_ids)
+
+
+async def _write_habit_order(user_id: str, habit_ids: list[str]):
+    from pymongo import UpdateOne
+
+    if habit_ids:
+        await habits_collection.bulk_write([
+            UpdateOne({"_id": habit_id, "user_id": user_id},
+                      _versioned({"$set": {"sort_index": float(len(habit_ids) - i)}}))
+            for i, habit_id in enumerate(habit_ids)
+        ], ordered=False)
+        await invalidate_user_reads(user_id)
+
+
+async def move_habit(habit_id: str, move: HabitMove):
+    """
+    Places a habit between two neighbours (as displayed, highest sort_index first) with a single write:
+    its new sort_index is the midpoint of theirs. Without `above_id` it goes to the top, without `below_id` to
+    the bottom. When the neighbours are too close for a midpoint the user's habits are rebalanced first.
+    """
+    if move.above_id is None and move.below_id is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Provide above_id and/or below_id.")
+    if habit_id in (move.above_id, move.below_id):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="A habit can't be its own neighbour.")
+
+    ids = [i for i in (habit_id, move.above_id, move.below_id) if i is not None]
     try:
-        result = habits_collection.delete_one({"_id": habit_id})
-        if result.deleted_count == 0:
+        for attempt in range(2):
+            habits = habits_collection.find({"_id": {"$in": ids}}, projection={"user_id": 1, "sort_index": 1})
+            habits = {habit["_id"]: habit async for habit in habits}
+            if len(habits) != len(ids) or len({habit["user_id"] for habit in habits.values()}) != 1:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Habit not found.")
+            user_id = habits[habit_id]["user_id"]
+
+            above = habits[move.above_id]["sort_index"] if move.above_id else None
+            below = habits[move.below_id]["sort_index"] if move.below_id else None
+            if above is None:
+                sort_index = below + 1
+            elif below is None:
+                sort_index = above - 1
+            else:
+                if above <= below:
+                    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                        detail="above_id must be sorted above below_id.")
+                sort_index = (above + below) / 2
+                if above - below < MIN_SORT_INDEX_GAP and attempt == 0:
+                    await rebalance_sort_indexes(user_id)
+                    continue
+            break
+
+        await habits_collection.update_one({"_id": habit_id}, _versioned({"$set": {"sort_index": sort_index}}))
+        await invalidate_user_reads(user_id)
+        return {"id": habit_id, "sort_index": sort_index, "rebalanced": attempt > 0}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="An error occurred while moving the habit.")
+
+
+async def reorder_user_habits(user_id: str, habit_ids: list[str]):
+    """Applies a full new ordering (top to bottom) of a user's habits with one bulk write."""
+    if len(set(habit_ids)) != len(habit_ids):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Habit ids must be unique.")
+    try:
+        habits = habits_collection.find({"user_id": user_id}, projection={"_id": 1})
+        user_habit_ids = {habit["_id"] async for habit in habits}
+        if user_habit_ids != set(habit_ids):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail="The ordering must list every habit of the user exactly once.")
+        await _write_habit_order(user_id, habit_ids)
+        return {"message": "Habits reordered successfully.", "count": len(habit_ids)}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="An error occurred while reordering the habits.")
+
+
+async def delete_habit(habit_id: str):
+    """Deletes the habit now and its completions and derived documents in a background job."""
+    try:
+        habit = await habits_collection.find_one_and_delete({"_id": habit_id}, projection={"user_id": 1})
+        if habit is None:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Habit not found.")
-        return {"message": "Habit deleted successfully."}
+        await invalidate_user_reads(habit["user_id"])
+        if completion_write_buffer is not None:
+            completion_write_buffer.discard_where(lambda key: key[0] == habit_id)
+        job = await jobs.start_job("delete_habit", habit_id)
+        return {"message": "Habit deleted successfully, its completions are being removed.", "job_id": job["_id"],
+                "status": job["status"]}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="An error occurred while deleting habit.")
 
@@ -259,48 +586,97 @@ def delete_habit(habit_id: str):
 # ----------------------
 # Completion CRUD Operations
 # ----------------------
-def create_completion(completion: CompletionCreate):
+async def create_completion(completion: CompletionCreate):
+    from pymongo.errors import DuplicateKeyError
+
     completion_data = jsonable_encoder(completion)
 
     try:
-        result = completions_collection.insert_one(completion_data)
+        if BUCKETED_COMPLETIONS:
+            await completion_buckets_collection.bulk_write([buckets.set_day_op(
+                completion_data["habit_id"], completion_data["user_id"], completion_data["date"],
+                completion_data["completed"], datetime.now(),
+            )])
+            inserted_id = buckets.completion_id(completion_data["habit_id"], completion_data["date"])
+        else:
+            result = await completions_collection.insert_one(completion_data)
+            inserted_id = result.inserted_id
+        await _on_completion_written(completion_data["habit_id"], completion_data["user_id"], completion_data["date"],
+                                     completion_data["completed"])
         # Convert ObjectId to string before returning
-        return {"id": str(result.inserted_id)}
+        return {"id": str(inserted_id)}
     except DuplicateKeyError:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Completion with that id already exists.")
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="An error occurred while creating the completion.")
 
 
-def get_completion(completion_id: str):
+async def _get_bucketed_completion(completion_id: str):
+    key = buckets.parse_completion_id(completion_id)
+    if key is None:
+        return None
+    habit_id, date = key
+    bucket = await completion_buckets_collection.find_one({"_id": buckets.bucket_id(habit_id, date)})
+    completions = buckets.explode(bucket, date, date) if bucket else []
+    return completions[0] if completions else None
+
+
+async def get_completion(completion_id: str):
     try:
-        completion = completions_collection.find_one(
+        if BUCKETED_COMPLETIONS:
+            return await _get_bucketed_completion(completion_id)
+        completion = await completions_collection.find_one(
             filter={"_id": completion_id},
         )
-        return jsonable_encoder(completion)
+        return completion
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail="An error occurred while fetching the completion.")
 
 
-def update_completion(completion_id: str, completion: CompletionUpdate):
+async def update_completion(completion_id: str, completion: CompletionUpdate):
+    from pymongo import ReturnDocument
+
     update_data = completion.model_dump(exclude_unset=True)
     if not update_data:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No update data provided.")
 
     try:
-        result = completions_collection.update_one({"_id": completion_id}, {"$set": update_data})
-        if result.matched_count == 0:
+        if BUCKETED_COMPLETIONS:
+            completion = await _get_bucketed_completion(completion_id)
+            if completion is not None:
+                completion.update(update_data, timestamp=datetime.now())
+                await completion_buckets_collection.bulk_write([buckets.set_day_op(
+                    completion["habit_id"], completion["user_id"], completion["date"], completion["completed"],
+                    completion["timestamp"],
+                )])
+        else:
+            completion = await completions_collection.find_one_and_update(
+                {"_id": completion_id}, {"$set": update_data}, return_document=ReturnDocument.AFTER
+            )
+        if completion is None:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Completion not found.")
-        return completions_collection.find_one({"_id": completion_id})
+        await _on_completion_written(completion["habit_id"], completion["user_id"], completion["date"],
+                                     completion.get("completed"))
+        return completion
 
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail="An error occurred while updating the completion.")
 
 
-def upsert_completion(request: CompletionUpsert):
-    timestamp = datetime.now()
+# Collection the _completion_upsert_op writes go to
+completion_store = completion_buckets_collection if BUCKETED_COMPLETIONS else completions_collection
+
+
+def _completion_upsert_op(request: CompletionUpsert, timestamp: datetime):
+    """Builds the write for one (habit_id, user_id, date) upsert, shared by the single and batch endpoints."""
+    from pymongo import DeleteOne, UpdateOne
+
+    if BUCKETED_COMPLETIONS:
+        if SPARSE_COMPLETIONS and not request.completed:
+            return buckets.unset_day_op(request.habit_id, request.date)
+        return buckets.set_day_op(request.habit_id, request.user_id, request.date, request.completed, timestamp)
 
     upsert_object = {
         "habit_id": request.habit_id,
@@ -308,63 +684,268 @@ def upsert_completion(request: CompletionUpsert):
         "date": request.date,
     }
 
+    if SPARSE_COMPLETIONS and not request.completed:
+        # Unchecked days are not stored in sparse mode
+        return DeleteOne(upsert_object)
+
     update_fields = {
         "$set": {
             "completed": request.completed,
             "timestamp": timestamp
-        }
+        },
+        # Same string ids as create_completion instead of a server generated ObjectId
+        "$setOnInsert": {"_id": str(uuid.uuid4())},
     }
+    return UpdateOne(upsert_object, update_fields, upsert=True)
+
+
+async def _flush_completion_writes(writes: list[tuple[CompletionUpsert, datetime]]):
+    """Writes out coalesced upserts from the write buffer, each with the time it was originally made."""
+    await completion_store.bulk_write(
+        [_completion_upsert_op(request, timestamp) for request, timestamp in writes], ordered=False
+    )
+    await _on_completions_written([(request.habit_id, request.user_id, request.date, request.completed)
+                                   for request, _ in writes])
+
+
+completion_write_buffer = WriteBuffer(
+    _flush_completion_writes,
+    interval=COMPLETION_WRITE_BUFFER_INTERVAL_SECONDS,
+    max_pending=COMPLETION_WRITE_BUFFER_MAX_PENDING,
+) if COMPLETION_WRITE_BUFFER else None
+
+
+async def close_completion_write_buffer():
+    """Flushes the completion write buffer, called when the app shuts down."""
+    if completion_write_buffer is not None:
+        await completion_write_buffer.close()
 
-    result = completions_collection.update_one(upsert_object, update_fields, upsert=True)
+
+async def upsert_completion(request: CompletionUpsert):
+    try:
+        _check_date(request.date)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid date, expected YYYY-MM-DD.")
+
+    if completion_write_buffer is not None:
+        # Repeated toggles of the same day within the flush interval become one write
+        await completion_write_buffer.put((request.habit_id, request.user_id, request.date), request)
+        return {"message": f"Attempted upsert with habit_id: {request.habit_id}, user_id: {request.user_id}, date {request.date}"}
+
+    timestamp = datetime.now()
+
+    result = await completion_store.bulk_write([_completion_upsert_op(request, timestamp)])
+    await _on_completion_written(request.habit_id, request.user_id, request.date, request.completed)
 
     return {"message": f"Attempted upsert with habit_id: {request.habit_id}, user_id: {request.user_id}, date {request.date}"}
 
 
+async def upsert_completions_batch(requests: list[CompletionUpsert]):
+    """
+    Applies many completion upserts with a single unordered bulk_write.
 
+    The batch is validated as a whole first (dates, duplicate keys, habit ownership); invalid items are reported
+    and skipped, the rest are written. Returns one result per item, in request order.
+    """
+    from pymongo.errors import BulkWriteError
 
+    if not requests:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No completions provided.")
+    if len(requests) > MAX_UPSERT_BATCH_SIZE:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"A batch can hold at most {MAX_UPSERT_BATCH_SIZE} completions.")
 
+    results = [{"index": i, "habit_id": request.habit_id, "date": request.date, "status": "ok"}
+               for i, request in enumerate(requests)]
 
+    def reject(i, error):
+        results[i]["status"] = "error"
+        results[i]["error"] = error
 
-def get_user_habit_completions(user_id: str, habit_id: str):
     try:
-        # need to convert Cursor object to list
-        completions = completions_collection.find(
-            filter={"habit_id": habit_id, "user_id": user_id},
-            sort=[("date", DESCENDING)],
+        habits = habits_collection.find(
+            {"_id": {"$in": list({request.habit_id for request in requests})}},
+            projection={"user_id": 1},
         )
+        habit_owners = {habit["_id"]: habit["user_id"] async for habit in habits}
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail="An error occurred while validating the completions.")
+
+    seen = {}
+    for i, request in enumerate(requests):
+        key = (request.habit_id, request.user_id, request.date)
+        try:
+            _check_date(request.date)
+        except ValueError:
+            reject(i, "Invalid date, expected YYYY-MM-DD.")
+        else:
+            if habit_owners.get(request.habit_id) != request.user_id:
+                reject(i, "Habit not found.")
+            elif key in seen:
+                reject(i, f"Duplicate of item {seen[key]}.")
+            else:
+                seen[key] = i
+
+    valid = list(seen.values())
+    if valid:
+        timestamp = datetime.now()
+        try:
+            await completion_store.bulk_write(
+                [_completion_upsert_op(requests[i], timestamp) for i in valid], ordered=False
+            )
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                reject(valid[error["index"]], error.get("errmsg", "Write failed."))
+        except Exception as e:
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                                detail="An error occurred while upserting the completions.")
+
+        written = [requests[i] for i in valid if results[i]["status"] == "ok"]
+        await _on_completions_written([(request.habit_id, request.user_id, request.date, request.completed)
+                                       for request in written])
+
+    failed = sum(1 for result in results if result["status"] != "ok")
+    return {"written": len(results) - failed, "failed": failed, "results": results}
+
 
-        return list(completions)
+async def _find_completions(habit_id: str, user_id: str | None = None, date_from=None, date_to=None,
+                            descending: bool = False, limit: int | None = None, completed_only: bool = False,
+                            projection: dict | None = None):
+    """
+    Yields one habit's stored completions in date order from the per-day documents or the monthly buckets,
+    whichever COMPLETION_STORAGE selects. `date_from`/`date_to` are inclusive.
+    """
+    date_from = _to_date(date_from).strftime("%Y-%m-%d") if date_from else None
+    date_to = _to_date(date_to).strftime("%Y-%m-%d") if date_to else None
+    query = {"habit_id": habit_id}
+    if user_id:
+        query["user_id"] = user_id
+
+    if BUCKETED_COMPLETIONS:
+        completions = buckets.find_completions(query, date_from, date_to, descending, limit, completed_only)
+        if projection is not None:
+            # A bucket holds the whole month either way, only the exploded documents can be trimmed
+            completions = (_project(completion, projection) async for completion in completions)
+    else:
+        date_filter = {}
+        if date_from:
+            date_filter["$gte"] = date_from
+        if date_to:
+            date_filter["$lte"] = date_to
+        if date_filter:
+            query["date"] = date_filter
+        if completed_only:
+            query["completed"] = True
+        completions = completions_collection.find(query, projection=projection,
+                                                  sort=[("date", DESCENDING if descending else ASCENDING)],
+                                                  limit=limit or 0)
+    async for completion in completions:
+        yield completion
+
+
+async def iter_user_habit_completions(user_id: str, habit_id: str, date_from: _date | None = None,
+                                     date_to: _date | None = None, before: _date | None = None,
+                                     limit: int | None = None, projection: dict | None = None):
+    """
+    Yields a habit's completions newest first, straight from the cursor.
+
+    `date_from`/`date_to` are inclusive bounds, `before` is the exclusive keyset cursor (the date of the last item
+    of the previous page) and `limit` caps the number of items. In sparse mode the unchecked days in the range
+    are generated on the fly. `projection` (see field_projection) has to keep `date`.
+    """
+    if not SPARSE_COMPLETIONS:
+        if before:
+            date_to = min(date_to, before - timedelta(days=1)) if date_to else before - timedelta(days=1)
+        async for completion in _find_completions(habit_id, user_id, date_from, date_to, descending=True,
+                                                  limit=limit, projection=projection):
+            yield completion
+        return
+
+    habit = await habits_collection.find_one({"_id": habit_id}, projection={"start_date": 1, "end_date": 1}) or {}
+    last_day = date_to or _date.today()
+    if not date_to:
+        if habit.get("end_date"):
+            last_day = min(last_day, _to_date(habit["end_date"]))
+        # Stored completions dated after that (checked ahead of time) are returned too, as in non-sparse mode
+        async for last_completion in _find_completions(habit_id, user_id, descending=True, limit=1):
+            last_day = max(last_day, _to_date(last_completion["date"]))
+    if before:
+        last_day = min(last_day, before - timedelta(days=1))
+
+    first_day = date_from or habit.get("start_date")
+    if first_day is None:
+        async for first_completion in _find_completions(habit_id, user_id, limit=1):
+            first_day = first_completion["date"]
+    if first_day is None:
+        return
+    first_day = _to_date(first_day)
+    if limit:
+        first_day = max(first_day, last_day - timedelta(days=limit - 1))
+
+    completions = _find_completions(habit_id, user_id, first_day, last_day, descending=True, projection=projection)
+    day = last_day
+    async for completion in completions:
+        completion_day = _to_date(completion["date"])
+        while day > completion_day:
+            yield _project(_missing_completion(user_id, habit_id, day), projection)
+            day -= timedelta(days=1)
+        if completion_day == day:
+            yield completion
+            day -= timedelta(days=1)
+    while day >= first_day:
+        yield _project(_missing_completion(user_id, habit_id, day), projection)
+        day -= timedelta(days=1)
+
+
+async def get_user_habit_completions(user_id: str, habit_id: str, date_from: _date | None = None,
+                                     date_to: _date | None = None, before: _date | None = None,
+                                     limit: int = COMPLETION_PAGE_SIZE, projection: dict | None = None):
+    """
+    One page of a habit's completion history, newest first. Pass the date of the last item as `before` to get
+    the next page; an empty list means there is nothing left.
+    """
+    limit = max(1, min(limit, MAX_COMPLETION_PAGE_SIZE))
+    try:
+        return [completion async for completion in
+                iter_user_habit_completions(user_id, habit_id, date_from, date_to, before, limit, projection)]
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail="An error occurred while fetching the completions.")
 
 
-def get_user_habit_completion_streak(user_id: str, habit_id: str):
+async def get_user_habit_completion_streak(user_id: str, habit_id: str):
+    """
+    Reads the streak counters stored on the habit (maintained by every completion write).
+    The current streak only counts if it runs through today in the user's timezone; a streak whose last day is
+    after that (checked ahead of time, or by a user ahead of the server's clock) is still live.
+    """
     try:
-        today = _date.today()  # Get today's date (date object)
-
-        # Fetch completions sorted by date (most recent first)
-        completions = completions_collection.find(
-            {"habit_id": habit_id, "user_id": user_id, "completed": True},
-            sort=[("date", DESCENDING)]
+        habit, user = await asyncio.gather(
+            habits_collection.find_one(
+                {"_id": habit_id, "user_id": user_id},
+                projection={"current_streak": 1, "longest_streak": 1, "last_completed_date": 1},
+            ),
+            users_collection.find_one({"_id": user_id}, projection={"timezone": 1}),
         )
+        if habit is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Habit not found.")
+        if "current_streak" not in habit:
+            # Habit created before streak counters existed
+            habit = await recompute_habit_streak(habit_id)
 
-        streak = 0
-        expected_date = today  # Start checking from today
-
-        for completion in completions:
-            completion_date = completion["date"]
-            if isinstance(completion_date, str):
-                completion_date = datetime.strptime(completion_date, "%Y-%m-%d").date()
-
-            if completion_date == expected_date:
-                streak += 1
-                expected_date -= timedelta(days=1)  # Move to the previous day
-            elif completion_date < expected_date:  # Gap found, streak breaks
-                break
+        today = _local_today((user or {}).get("timezone"), {})
+        last_completed = habit["last_completed_date"]
+        streak = habit["current_streak"] if last_completed and last_completed >= today else 0
 
-        return {"streak": streak}
+        return {
+            "streak": streak,
+            "longest_streak": habit["longest_streak"],
+            "last_completed_date": habit["last_completed_date"],
+        }
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -372,46 +953,835 @@ def get_user_habit_completion_streak(user_id: str, habit_id: str):
         )
 
 
-def prepare_completions():
-    # If a completion for today exists, it won’t be modified.
-    # If a completion for today doesn’t exist, it creates a new one.
+def _missing_completion(user_id: str, habit_id: str, day: _date):
+    """Row standing in for a day that has no stored completion (sparse mode)."""
+    return {
+        "habit_id": habit_id,
+        "user_id": user_id,
+        "date": day.strftime("%Y-%m-%d"),
+        "completed": False,
+    }
+
+
+# ----------------------
+# Streak Counters
+# ----------------------
+def _to_date(value) -> _date:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, _date):
+        return value
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def _check_date(value: str):
+    """
+    Raises ValueError unless `value` is a valid date written exactly YYYY-MM-DD. strptime alone also takes
+    "2025-1-5", which would break date ordering, range queries, bucket keys and bitmap offsets once stored.
+    """
+    if _to_date(value).strftime("%Y-%m-%d") != value:
+        raise ValueError(f"{value!r} is not a YYYY-MM-DD date")
+
+
+async def recompute_habit_streak(habit_id: str):
+    """
+    Rebuilds current_streak, longest_streak and last_completed_date for one habit from its completion history.
+    Used for backfills and for the edits the incremental path cannot handle (unchecking or back-filling a past day).
+    """
+    completions = _find_completions(habit_id, completed_only=True)
+
+    current = longest = 0
+    last_date = None
+    async for completion in completions:
+        completion_date = _to_date(completion["date"])
+        if last_date is not None and completion_date == last_date:
+            continue
+        if last_date is not None and completion_date == last_date + timedelta(days=1):
+            current += 1
+        else:
+            current = 1
+        longest = max(longest, current)
+        last_date = completion_date
+
+    counters = {
+        "current_streak": current,
+        "longest_streak": longest,
+        "last_completed_date": last_date.strftime("%Y-%m-%d") if last_date else None,
+    }
+    await habits_collection.update_one({"_id": habit_id}, _versioned({"$set": counters}))
+    return counters
+
+
+async def _apply_completion_to_streak(habit_id: str, completion_date, completed: bool):
+    """
+    Updates the habit's streak counters for one completion write.
+
+    Checking off the day after last_completed_date (or any later day) is an O(1) compare-and-set on the habit
+    document; if another write moved last_completed_date in the meantime, or the edit reaches into the history
+    (unchecking a counted day, back-filling an older one), the counters are recomputed instead.
+
+    The completion write and this update are separate writes. While another write to the same habit's history
+    is in flight, a recompute can read the history without it and store counters that miss it. Such drift lasts
+    until the counters are next recomputed (unchecking or back-filling a day of that habit does it) or
+    `python manage.py backfill-streaks` runs.
+    """
+    habit = await habits_collection.find_one(
+        {"_id": habit_id},
+        projection={"current_streak": 1, "longest_streak": 1, "last_completed_date": 1},
+    )
+    if habit is None:
+        return
+    if "current_streak" not in habit:
+        await recompute_habit_streak(habit_id)
+        return
+
+    day = _to_date(completion_date)
+    last_completed = habit["last_completed_date"]
+    last_day = _to_date(last_completed) if last_completed else None
+
+    if not completed:
+        if last_day is None or day > last_day:
+            return  # nothing counted on or after that day
+        await recompute_habit_streak(habit_id)
+        return
+
+    if last_day is not None and day == last_day:
+        return
+    if last_day is not None and day < last_day:
+        await recompute_habit_streak(habit_id)
+        return
+
+    current = habit["current_streak"] + 1 if last_day is not None and day == last_day + timedelta(days=1) else 1
+    result = await habits_collection.update_one(
+        {"_id": habit_id, "last_completed_date": last_completed},
+        {"$set": {
+            "current_streak": current,
+            "longest_streak": max(habit["longest_streak"], current),
+            "last_completed_date": day.strftime("%Y-%m-%d"),
+        }},
+    )
+    if result.matched_count == 0:
+        await recompute_habit_streak(habit_id)
+
+
+async def _on_completion_written(habit_id: str, user_id: str, completion_date, completed: bool):
+    """Keeps the data derived from completions in sync, called after every completion write."""
+    await asyncio.gather(
+        # The habit's completions are part of what its version covers (dashboard ETags)
+        habits_collection.update_one({"_id": habit_id}, _versioned({})),
+        _apply_completion_to_streak(habit_id, completion_date, bool(completed)),
+        completion_bitmaps_collection.bulk_write([_bitmap_op(habit_id, user_id, completion_date, completed)]),
+    )
+    await invalidate_user_reads(user_id, completion_date)
+
+
+async def _on_completions_written(writes: list[tuple]):
+    """
+    Batch version of _on_completion_written for (habit_id, user_id, date, completed) tuples. A habit touched
+    once goes through the incremental streak path, a habit touched several times is recomputed once.
+    """
+    writes_by_habit = {}
+    dates_by_user = {}
+    for habit_id, user_id, completion_date, completed in writes:
+        writes_by_habit.setdefault(habit_id, []).append((completion_date, completed))
+        dates_by_user.setdefault(user_id, set()).add(completion_date)
+
+    await asyncio.gather(
+        habits_collection.update_many({"_id": {"$in": list(writes_by_habit)}}, _versioned({})),
+        completion_bitmaps_collection.bulk_write([_bitmap_op(*write) for write in writes], ordered=False),
+        *(
+            _apply_completion_to_streak(habit_id, habit_writes[0][0], bool(habit_writes[0][1]))
+            if len(habit_writes) == 1 else recompute_habit_streak(habit_id)
+            for habit_id, habit_writes in writes_by_habit.items()
+        ),
+    )
+    for user_id, dates in dates_by_user.items():
+        await invalidate_user_reads(user_id, *dates)
+
+
+async def backfill_habit_streaks(batch_size: int = 100):
+    """Recomputes the streak counters of every habit, `batch_size` habits at a time."""
+    habits = habits_collection.find({}, projection={"_id": 1})
+    updated = 0
+    batch = []
+    async for habit in habits:
+        batch.append(recompute_habit_streak(habit["_id"]))
+        if len(batch) >= batch_size:
+            await asyncio.gather(*batch)
+            updated += len(batch)
+            batch = []
+    if batch:
+        await asyncio.gather(*batch)
+        updated += len(batch)
+    return {"habits_updated": updated}
+
+
+# ----------------------
+# Completion Bitmaps
+# ----------------------
+# One document per habit per year: {_id: "<habit_id>:<year>", habit_id, user_id, year, m1..m12}, where bit
+# d-1 of m<month> is set when day d of that month is completed. Writes flip a single bit with $bit, reads of a
+# whole year are one small document instead of 365 completions.
+def _bitmap_op(habit_id: str, user_id: str, completion_date, completed: bool):
+    from pymongo import UpdateOne
+
+    day = _to_date(completion_date)
+    mask = 1 << (day.day - 1)
+    return UpdateOne(
+        {"_id": f"{habit_id}:{day.year}"},
+        {
+            "$bit": {f"m{day.month}": {"or": mask} if completed else {"and": ~mask}},
+            "$setOnInsert": {"habit_id": habit_id, "user_id": user_id, "year": day.year},
+        },
+        upsert=True,
+    )
+
+
+def _year_bits(bitmap: dict) -> int:
+    """Month words of a bitmap document as one integer where bit n is day-of-year n + 1."""
+    bits = 0
+    offset = 0
+    for month in range(1, 13):
+        days_in_month = calendar.monthrange(bitmap["year"], month)[1]
+        bits |= (bitmap.get(f"m{month}", 0) & ((1 << days_in_month) - 1)) << offset
+        offset += days_in_month
+    return bits
+
+
+def _runs(bits: int):
+    """[first_day_of_year, length] for every run of completed days."""
+    runs = []
+    day = 0
+    while bits:
+        skip = (bits & -bits).bit_length() - 1
+        bits >>= skip
+        day += skip
+        length = (~bits & (bits + 1)).bit_length() - 1
+        runs.append([day + 1, length])
+        bits >>= length
+        day += length
+    return runs
+
+
+async def get_user_heatmap(user_id: str, year: int, encoding: str = "base64"):
+    """
+    Completion bitmaps of all of a user's habits for one year, from a single query.
+
+    encoding="base64": little-endian bitset, bit n (byte n // 8, bit n % 8) is day-of-year n + 1.
+    encoding="runs": list of [first_day_of_year, length] runs of completed days.
+    Habits without any completion that year are left out.
+    """
+    days_in_year = 366 if calendar.isleap(year) else 365
     try:
-        # today = _date.today()  # Get today's date
-        # today_datetime = datetime.now()
-        today_str = _date.today().strftime("%Y-%m-%d")
+        bitmaps = completion_bitmaps_collection.find({"user_id": user_id, "year": year})
+        habits = {}
+        async for bitmap in bitmaps:
+            bits = _year_bits(bitmap)
+            if encoding == "runs":
+                habits[bitmap["habit_id"]] = _runs(bits)
+            else:
+                habits[bitmap["habit_id"]] = base64.b64encode(bits.to_bytes((days_in_year + 7) // 8, "little")).decode()
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail="An error occurred while fetching the heatmap.")
+
+    return {"year": year, "days_in_year": days_in_year, "encoding": encoding, "habits": habits}
+
+
+async def rebuild_habit_bitmaps(habit_id: str):
+    """Rewrites a habit's bitmap documents from its completion history."""
+    months = {}
+    user_id = None
+    async for completion in _find_completions(habit_id, completed_only=True):
+        day = _to_date(completion["date"])
+        user_id = completion["user_id"]
+        months.setdefault(day.year, {}).setdefault(f"m{day.month}", 0)
+        months[day.year][f"m{day.month}"] |= 1 << (day.day - 1)
+
+    await completion_bitmaps_collection.delete_many({"habit_id": habit_id})
+    if months:
+        await completion_bitmaps_collection.insert_many([
+            {"_id": f"{habit_id}:{year}", "habit_id": habit_id, "user_id": user_id, "year": year, **words}
+            for year, words in months.items()
+        ])
+    return len(months)
+
+
+async def backfill_completion_bitmaps(batch_size: int = 50):
+    """Rebuilds the bitmaps of every habit, `batch_size` habits at a time."""
+    habits = habits_collection.find({}, projection={"_id": 1})
+    updated = 0
+    batch = []
+    async for habit in habits:
+        batch.append(rebuild_habit_bitmaps(habit["_id"]))
+        if len(batch) >= batch_size:
+            await asyncio.gather(*batch)
+            updated += len(batch)
+            batch = []
+    if batch:
+        await asyncio.gather(*batch)
+        updated += len(batch)
+    return {"habits_updated": updated}
+
+
+def _placeholder_op(habit_id: str, user_id: str, today_str: str):
+    """Writes a `completed: False` completion for the day unless one exists."""
+    from pymongo import UpdateOne
+
+    if BUCKETED_COMPLETIONS:
+        # Pipeline update so an existing value for the day is kept
+        day_field = f"days.{today_str[8:]}"
+        return UpdateOne(
+            {"_id": buckets.bucket_id(habit_id, today_str)},
+            [{"$set": {
+                "habit_id": habit_id,
+                "user_id": user_id,
+                "month": today_str[:7],
+                day_field: {"$ifNull": [f"${day_field}", {"c": False}]},
+            }}],
+            upsert=True,
+        )
+    # Upsert: Insert if not exists
+    return UpdateOne(
+        {"habit_id": habit_id, "user_id": user_id, "date": today_str},
+        {"$setOnInsert": {"completed": False, "_id": str(uuid.uuid4())}},
+        upsert=True
+    )
 
 
-        # Fetch all habits
-        habits = habits_collection.find({}, {"_id": 1, "user_id": 1})
+def _local_today(timezone: str | None, todays: dict):
+    """Today's date string in a user's timezone (server local time without one), memoized per run in `todays`."""
+    if timezone not in todays:
+        try:
+            now = datetime.now(ZoneInfo(timezone)) if timezone else datetime.now()
+        except (ZoneInfoNotFoundError, ValueError):
+            now = datetime.now()
+        todays[timezone] = now.strftime("%Y-%m-%d")
+    return todays[timezone]
 
-        bulk_operations = []
 
-        for habit in habits:
-            habit_id = habit["_id"]
-            user_id = habit["user_id"]
-
-            # Upsert: Insert if not exists
-            bulk_operations.append(
-                UpdateOne(
-                    {"habit_id": habit_id, "user_id": user_id, "date": today_str},
-                    {"$setOnInsert": {"completed": False}},
-                    upsert=True
-                )
+async def _prepare_completions_batch(habits: list[dict], todays: dict):
+    from pymongo.errors import BulkWriteError
+
+    started = time.perf_counter()
+    users = users_collection.find({"_id": {"$in": list({habit["user_id"] for habit in habits})}},
+                                  projection={"timezone": 1})
+    timezones = {user["_id"]: user.get("timezone") async for user in users}
+
+    days = [_local_today(timezones.get(habit["user_id"]), todays) for habit in habits]
+    operations = [_placeholder_op(habit["_id"], habit["user_id"], day) for habit, day in zip(habits, days)]
+    errors = 0
+    try:
+        result = await completion_store.bulk_write(operations, ordered=False)
+        upserted = result.upserted_count
+        inserted = set(result.upserted_ids)
+    except BulkWriteError as e:
+        upserted = e.details.get("nUpserted", 0)
+        errors = len(e.details.get("writeErrors", []))
+        inserted = {write["index"] for write in e.details.get("upserted", [])}
+
+    # A new placeholder turns the day's dashboard value from null to false, so the habit's version (dashboard
+    # ETags) moves and cached dashboards are dropped. Bucket writes don't tell which days were new: all count.
+    changed = range(len(habits)) if BUCKETED_COMPLETIONS else sorted(inserted)
+    if changed:
+        await habits_collection.update_many({"_id": {"$in": [habits[i]["_id"] for i in changed]}}, _versioned({}))
+        for user_id, day in {(habits[i]["user_id"], days[i]) for i in changed}:
+            await invalidate_user_reads(user_id, day)
+    return {"habits": len(habits), "upserted": upserted, "errors": errors,
+            "ms": round((time.perf_counter() - started) * 1000, 2)}
+
+
+async def prepare_completions(batch_size: int = PREPARE_BATCH_SIZE, concurrency: int = PREPARE_CONCURRENCY,
+                              time_budget: float = PREPARE_TIME_BUDGET_SECONDS, restart: bool = False):
+    """
+    Writes today's `completed: False` placeholder for every habit, with "today" taken in the owner's timezone.
+    Existing completions are never modified.
+
+    Habits are read in `_id` order, `batch_size` at a time, with at most `concurrency` batch writes in flight.
+    The last habit of every finished batch is checkpointed in the jobs collection; once `time_budget` seconds
+    are used up the run stops and the next call resumes from the checkpoint (`restart` starts over). Run it at
+    least hourly so every timezone gets its placeholder shortly after its midnight.
+    """
+    if SPARSE_COMPLETIONS:
+        return {
+            "message": "Sparse completions enabled, nothing to prepare.",
+            "inserted_count": 0
+        }
+
+    started = time.perf_counter()
+    checkpoints = jobs_collection
+    try:
+        state = None if restart else await checkpoints.find_one({"_id": PREPARE_JOB_ID, "done": False})
+        last_habit_id = state["last_habit_id"] if state else None
+        if state is None:
+            await checkpoints.update_one(
+                {"_id": PREPARE_JOB_ID},
+                {"$set": {"done": False, "last_habit_id": None, "started_at": datetime.now()}},
+                upsert=True,
             )
 
-        inserted_count = 0
-        if bulk_operations:
-            result = completions_collection.bulk_write(bulk_operations)
-            inserted_count = result.inserted_count
+        todays = {}
+        batches = []
+        in_flight = []
+
+        async def finish_oldest():
+            batch_last_id, task = in_flight.pop(0)
+            batches.append({"batch": len(batches), **await task})
+            await checkpoints.update_one({"_id": PREPARE_JOB_ID}, {"$set": {"last_habit_id": batch_last_id}})
 
+        done = False
+        while True:
+            if time.perf_counter() - started > time_budget:
+                break
+            query = {"_id": {"$gt": last_habit_id}} if last_habit_id is not None else {}
+            habits = await habits_collection.find(
+                query, projection={"_id": 1, "user_id": 1}, sort=[("_id", ASCENDING)], limit=batch_size
+            ).to_list()
+            if not habits:
+                done = True
+                break
+            last_habit_id = habits[-1]["_id"]
+            task = asyncio.create_task(_prepare_completions_batch(habits, todays), context=background_context())
+            in_flight.append((last_habit_id, task))
+            if len(in_flight) >= concurrency:
+                await finish_oldest()
+        while in_flight:
+            await finish_oldest()
+
+        if done:
+            await checkpoints.update_one({"_id": PREPARE_JOB_ID},
+                                         {"$set": {"done": True, "finished_at": datetime.now()}})
 
         return {
-            "message": "Today's completions prepared successfully.",
-            "inserted_count": inserted_count
+            "message": "Today's completions prepared successfully." if done
+            else "Time budget used up, call again to continue.",
+            "done": done,
+            "inserted_count": sum(batch["upserted"] for batch in batches),
+            "habits": sum(batch["habits"] for batch in batches),
+            "errors": sum(batch["errors"] for batch in batches),
+            "dates": sorted(set(todays.values())),
+            "elapsed_s": round(time.perf_counter() - started, 3),
+            "batches": batches,
         }
 
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"An error occurred while preparing completions: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+
+# BSON types completion _ids have: ObjectId (generated by Mongo for older upserts and placeholders) or string (uuid)
+_ID_TYPES = ("objectId", "string")
+
+
+async def _id_batches(collection, query: dict, batch_size: int):
+    """
+    Yields the _ids of the documents matching `query` `batch_size` at a time, walking the collection once in
+    _id order. `$gt` only compares values of the same BSON type, so each _id type gets its own pass.
+    """
+    for id_type in _ID_TYPES:
+        last_id = None
+        while True:
+            id_query = {"$type": id_type} if last_id is None else {"$type": id_type, "$gt": last_id}
+            batch = await collection.find(
+                {**query, "_id": id_query}, projection={"_id": 1}, sort=[("_id", ASCENDING)], limit=batch_size
+            ).to_list()
+            if not batch:
+                break
+            last_id = batch[-1]["_id"]
+            yield [document["_id"] for document in batch]
+
+
+async def purge_placeholder_completions(batch_size: int = 1000):
+    """
+    Deletes the `completed: False` documents written by prepare_completions (or by unchecking a day) once
+    SPARSE_COMPLETIONS is on, or the unchecked days of every bucket. Works in batches of `batch_size` ids so
+    each write stays short, walking the collection once in _id order (like prepare_completions).
+    """
+    if not SPARSE_COMPLETIONS:
+        return {"deleted": 0, "message": "SPARSE_COMPLETIONS is off, placeholders are still needed."}
+
+    if BUCKETED_COMPLETIONS:
+        unchecked = {"$filter": {"input": {"$objectToArray": "$days"}, "cond": {"$ne": ["$$this.v.c", True]}}}
+        updated = 0
+        async for ids in _id_batches(completion_buckets_collection,
+                                     {"$expr": {"$gt": [{"$size": unchecked}, 0]}}, batch_size):
+            # Keep only the checked days of the bucket
+            result = await completion_buckets_collection.update_many({"_id": {"$in": ids}}, [{"$set": {
+                "days": {"$arrayToObject": {
+                    "$filter": {"input": {"$objectToArray": "$days"}, "cond": {"$eq": ["$$this.v.c", True]}},
+                }},
+            }}])
+            updated += result.modified_count
+        return {"buckets_updated": updated}
+
+    deleted = 0
+    async for ids in _id_batches(completions_collection, {"completed": {"$ne": True}}, batch_size):
+        result = await completions_collection.delete_many({"_id": {"$in": ids}})
+        deleted += result.deleted_count
+    return {"deleted": deleted}
+
+
+# ----------------------
+# Cascading Deletes
+# ----------------------
+# Collections holding per-habit data, all carry habit_id and user_id
+_DEPENDENT_COLLECTIONS = {
+    "completions": completions_collection,
+    "completion_buckets": completion_buckets_collection,
+    "completion_bitmaps": completion_bitmaps_collection,
+}
+
+
+async def _delete_in_batches(collection, query: dict, batch_size: int = JOB_BATCH_SIZE, on_batch=None):
+    """
+    Deletes the documents matching `query` `batch_size` ids at a time so no single delete runs long.
+    `on_batch(deleted)` is awaited after every batch. Returns how many documents were deleted.
+    """
+    deleted = 0
+    while True:
+        batch = await collection.find(query, projection={"_id": 1}, limit=batch_size).to_list()
+        if not batch:
+            return deleted
+        result = await collection.delete_many({"_id": {"$in": [document["_id"] for document in batch]}})
+        deleted += result.deleted_count
+        if on_batch is not None:
+            await on_batch(result.deleted_count)
+
+
+async def _delete_dependents(field: str, value: str, progress):
+    for name, collection in _DEPENDENT_COLLECTIONS.items():
+        await _delete_in_batches(collection, {field: value}, on_batch=lambda count, name=name: progress(**{name: count}))
+
+
+async def cascade_delete_user(user_id: str, progress):
+    """Job removing a deleted user's habits, then everything stored per habit."""
+    # Habits first, so prepare_completions stops writing placeholders for them
+    await _delete_in_batches(habits_collection, {"user_id": user_id}, on_batch=lambda count: progress(habits=count))
+    await _delete_dependents("user_id", user_id, progress)
+
+
+async def cascade_delete_habit(habit_id: str, progress):
+    """Job removing everything stored for a deleted habit."""
+    await _delete_dependents("habit_id", habit_id, progress)
+
+
+jobs.register("delete_user", cascade_delete_user)
+jobs.register("delete_habit", cascade_delete_habit)
+
+
+async def _sweep(collection, parent_field: str, parents, batch_size: int, dry_run: bool):
+    """Deletes the documents of `collection` whose `parent_field` points at no document of `parents`."""
+    parent_ids = await collection.aggregate([{"$group": {"_id": f"${parent_field}"}}], allowDiskUse=True,
+                                            batchSize=batch_size)
+    orphaned = deleted = 0
+
+    async def check(ids):
+        nonlocal orphaned, deleted
+        existing = {parent["_id"] async for parent in parents.find({"_id": {"$in": ids}}, projection={"_id": 1})}
+        for parent_id in ids:
+            if parent_id in existing:
+                continue
+            orphaned += 1
+            if dry_run:
+                deleted += await collection.count_documents({parent_field: parent_id})
+            else:
+                deleted += await _delete_in_batches(collection, {parent_field: parent_id}, batch_size)
+
+    batch = []
+    async for group in parent_ids:
+        batch.append(group["_id"])
+        if len(batch) >= batch_size:
+            await check(batch)
+            batch = []
+    if batch:
+        await check(batch)
+    return {"missing_parents": orphaned, "deleted": deleted}
+
+
+async def sweep_orphans(batch_size: int = JOB_BATCH_SIZE, dry_run: bool = False):
+    """
+    Purges habits of deleted users, then completions, buckets and bitmaps of deleted habits, left behind before
+    deletes cascaded. Parents are checked and children deleted in batches of `batch_size`.
+    """
+    report = {"habits": await _sweep(habits_collection, "user_id", users_collection, batch_size, dry_run)}
+    for name, collection in _DEPENDENT_COLLECTIONS.items():
+        report[name] = await _sweep(collection, "habit_id", habits_collection, batch_size, dry_run)
+    report["dry_run"] = dry_run
+    return report
+
+
+# ----------------------
+# Export / import
+# ----------------------
+# What an export holds of each habit and completion, and the columns of the CSV format (a `type` column tells
+# habit rows from completion rows). Streak counters, bitmaps and versions are derived and rebuilt on import.
+EXPORT_HABIT_FIELDS = ("_id", "user_id", "name", "description", "sort_index", "category", "color", "icon",
+                       "start_date", "end_date", "archived")
+EXPORT_COMPLETION_FIELDS = ("_id", "habit_id", "user_id", "date", "completed")
+EXPORT_CSV_COLUMNS = ("type", *EXPORT_HABIT_FIELDS, "habit_id", "date", "completed")
+
+
+async def _require_user(user_id: str):
+    try:
+        user = await users_collection.find_one({"_id": user_id}, projection={"_id": 1})
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail="An error occurred while fetching the user.")
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found.")
+
+
+async def export_user_data(user_id: str):
+    """
+    Checks that the user exists and returns an async iterator over all of their data as ("habit" | "completion",
+    document) pairs, habits first. Documents come straight off the cursors, so memory use doesn't grow with
+    the amount of data.
+    """
+    await _require_user(user_id)
+
+    async def rows():
+        habits = habits_collection.find({"user_id": user_id}, projection={field: 1 for field in EXPORT_HABIT_FIELDS},
+                                        sort=[("sort_index", DESCENDING)])
+        async for habit in habits:
+            yield "habit", habit
+
+        projection = {field: 1 for field in EXPORT_COMPLETION_FIELDS}
+        if BUCKETED_COMPLETIONS:
+            completions = buckets.find_completions({"user_id": user_id})
+        else:
+            # Served by the (user_id, date) index
+            completions = completions_collection.find({"user_id": user_id}, projection=projection,
+                                                      sort=[("date", ASCENDING)])
+        async for completion in completions:
+            yield "completion", _project(completion, projection)
+
+    return rows()
+
+
+async def _import_lines(chunks):
+    """Yields (line number, text) for each line of a streamed UTF-8 body."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    pending = ""
+    number = 0
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            number += 1
+            yield number, line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield number + 1, pending.rstrip("\r")
+
+
+async def _import_rows(chunks, format: str):
+    """
+    Yields (line number, row dict or None, error or None) for each record of an NDJSON or CSV body. CSV records
+    may span lines (quoted newlines) and start with a header row; empty CSV fields are left out of the row.
+    """
+    if format == "ndjson":
+        async for number, line in _import_lines(chunks):
+            if not line.strip():
+                continue
+            try:
+                row = orjson.loads(line)
+            except orjson.JSONDecodeError as e:
+                yield number, None, f"Invalid JSON: {e}"
+                continue
+            if isinstance(row, dict):
+                yield number, row, None
+            else:
+                yield number, None, "Expected a JSON object."
+        return
+
+    header = None
+    record, first_line = "", None
+    async for number, line in _import_lines(chunks):
+        record = f"{record}\n{line}" if first_line is not None else line
+        first_line = first_line or number
+        if record.count('"') % 2:
+            continue  # a quoted field goes on on the next line
+        values = next(csv.reader([record]), [])
+        record_line, record, first_line = first_line, "", None
+        if not any(values):
+            continue
+        if header is None:
+            header = values
+            continue
+        if len(values) != len(header):
+            yield record_line, None, f"Expected {len(header)} columns, got {len(values)}."
+            continue
+        yield record_line, {column: value for column, value in zip(header, values) if value != ""}, None
+    if record:
+        yield first_line, None, "Unterminated quoted field."
+
+
+def _validation_message(error: ValidationError):
+    return "; ".join(f"{'.'.join(map(str, detail['loc'])) or 'row'}: {detail['msg']}" for detail in error.errors())
+
+
+async def import_user_data(user_id: str, chunks, format: str = "ndjson"):
+    """
+    Imports rows in the export format into a user (their user_id is replaced by `user_id`).
+
+    Rows are validated against HabitCreate/CompletionCreate as they stream in and written every
+    IMPORT_CHUNK_SIZE rows with unordered bulk writes: habits are upserted by id, completions go through the same
+    upsert as PUT /completions/upsert (whichever COMPLETION_STORAGE is set) and must belong to one of the user's
+    habits, existing or imported earlier in the body. Invalid or failed rows are counted and reported by line,
+    the rest is written. Streak counters of the habits that got completions are recomputed at the end.
+
+    An export can be imported into another account: habits whose id is taken by another user's habit are
+    imported under a new id (the same one on every import into this user) and their completions follow them.
+    """
+    from pymongo import UpdateOne
+    from pymongo.errors import BulkWriteError
+
+    await _require_user(user_id)
+    started = time.perf_counter()
+    try:
+        known_habits = {habit["_id"] async for habit in habits_collection.find({"user_id": user_id},
+                                                                               projection={"_id": 1})}
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail="An error occurred while fetching the user's habits.")
+
+    report = {"rows": 0, "habits": 0, "completions": 0, "failed": 0, "errors": []}
+    touched_habits = set()
+    remapped = {}  # habit id in the body -> id it was imported under, for ids taken by another user's habits
+    habit_rows, completion_rows = [], {}  # (line, data), (habit_id, date) -> (line, CompletionUpsert)
+
+    def reject(line, error):
+        report["failed"] += 1
+        if len(report["errors"]) < IMPORT_MAX_REPORTED_ERRORS:
+            report["errors"].append({"line": line, "error": error})
+
+    def habit_op(habit_id, data):
+        return UpdateOne({"_id": habit_id, "user_id": user_id}, _versioned({
+            "$set": {key: value for key, value in data.items() if key != "_id"},
+            "$setOnInsert": {"current_streak": 0, "longest_streak": 0, "last_completed_date": None},
+        }), upsert=True)
+
+    async def write_habits(rows):
+        """Upserts (line, id, data) rows, returns {index: write error} of the rows that failed."""
+        try:
+            await habits_collection.bulk_write([habit_op(habit_id, data) for _, habit_id, data in rows],
+                                               ordered=False)
+        except BulkWriteError as e:
+            return {error["index"]: error for error in e.details.get("writeErrors", [])}
+        return {}
+
+    async def flush():
+        failed_habits = set()
+        if habit_rows:
+            rows = [(line, remapped.get(data["_id"], data["_id"]), data) for line, data in habit_rows]
+            errors = await write_habits(rows)
+            # A duplicate key means the id belongs to a habit of another user (importing someone else's export):
+            # such habits get an id of their own, derived from the source id so that importing again updates them
+            retry = [index for index, error in errors.items() if error.get("code") == 11000]
+            if retry:
+                retried = []
+                for index in retry:
+                    line, _, data = rows[index]
+                    remapped[data["_id"]] = str(uuid.uuid5(uuid.NAMESPACE_URL, f"{user_id}/habits/{data['_id']}"))
+                    retried.append((line, remapped[data["_id"]], data))
+                retry_errors = await write_habits(retried)
+                for index, row_index in enumerate(retry):
+                    if index in retry_errors:
+                        errors[row_index] = retry_errors[index]
+                    else:
+                        del errors[row_index]
+            for index, error in sorted(errors.items()):
+                line, _, data = rows[index]
+                failed_habits.add(data["_id"])
+                reject(line, error.get("errmsg", "Write failed."))
+            report["habits"] += len(habit_rows) - len(failed_habits)
+            known_habits.update(remapped.get(data["_id"], data["_id"]) for _, data in habit_rows
+                                if data["_id"] not in failed_habits)
+
+        completions = []
+        for line, request in completion_rows.values():
+            if request.habit_id in failed_habits:
+                reject(line, "Habit not found.")
+            elif request.habit_id in remapped:
+                completions.append((line, request.model_copy(update={"habit_id": remapped[request.habit_id]})))
+            else:
+                completions.append((line, request))
+        if completions:
+            timestamp = datetime.now()
+            failed = set()
+            try:
+                await completion_store.bulk_write(
+                    [_completion_upsert_op(request, timestamp) for _, request in completions], ordered=False
+                )
+            except BulkWriteError as e:
+                for error in e.details.get("writeErrors", []):
+                    failed.add(error["index"])
+                    reject(completions[error["index"]][0], error.get("errmsg", "Write failed."))
+            written = [request for i, (_, request) in enumerate(completions) if i not in failed]
+            if written:
+                await completion_bitmaps_collection.bulk_write(
+                    [_bitmap_op(request.habit_id, user_id, request.date, request.completed) for request in written],
+                    ordered=False,
+                )
+            report["completions"] += len(written)
+            touched_habits.update(request.habit_id for request in written)
+
+        habit_rows.clear()
+        completion_rows.clear()
+
+    pending_habits = set()
+    try:
+        async for line, row, error in _import_rows(chunks, format):
+            report["rows"] += 1
+            if error:
+                reject(line, error)
+                continue
+            kind = row.pop("type", None)
+            row["user_id"] = user_id
+            try:
+                if kind == "habit":
+                    data = jsonable_encoder(HabitCreate(**row))
+                    if data["sort_index"] is None:
+                        data["sort_index"] = time.time()
+                    habit_rows.append((line, data))
+                    pending_habits.add(data["_id"])
+                elif kind == "completion":
+                    completion = CompletionCreate(**row)
+                    if (completion.habit_id not in known_habits and completion.habit_id not in pending_habits
+                            and completion.habit_id not in remapped):
+                        reject(line, "Habit not found.")
+                        continue
+                    request = CompletionUpsert(user_id=user_id, habit_id=completion.habit_id,
+                                               date=completion.date.strftime("%Y-%m-%d"),
+                                               completed=bool(completion.completed))
+                    # A day given twice in a chunk keeps its last row
+                    completion_rows[(request.habit_id, request.date)] = (line, request)
+                else:
+                    reject(line, "type must be 'habit' or 'completion'.")
+                    continue
+            except ValidationError as e:
+                reject(line, _validation_message(e))
+                continue
+
+            if len(habit_rows) + len(completion_rows) >= IMPORT_CHUNK_SIZE:
+                await flush()
+                pending_habits.clear()
+        await flush()
+
+
+        for habit_id in touched_habits:
+            await recompute_habit_streak(habit_id)
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail=f"An error occurred while importing, {report['habits']} habits and "
+                                   f"{report['completions']} completions were written: {str(e)}")
+    finally:
+        await invalidate_user_reads(user_id)
+
+    report["errors"].sort(key=lambda error: error["line"])
+    elapsed = time.perf_counter() - started
+    report["elapsed_s"] = round(elapsed, 3)
+    report["rows_per_s"] = round(report["rows"] / elapsed, 1) if elapsed else None
+    return report
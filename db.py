@@ -1,13 +1,76 @@
-from pymongo import MongoClient
 from config import MONGO_URI, DATABASE_NAME
+from config import MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE, MONGO_MAX_IDLE_TIME_MS, MONGO_WAIT_QUEUE_TIMEOUT_MS
+from config import METRICS_ENABLED
+
+# The client is created on first use rather than at import time, so importing the app (a Lambda cold start)
+# does not pay for pymongo or URI/SRV parsing. warm_up() creates it and opens a connection ahead of time.
+# No module imports pymongo at the top for the same reason: write models and errors are imported by the
+# functions using them, and sort directions are these plain values (the same as pymongo.ASCENDING/DESCENDING).
+_client = None
+ASCENDING = 1
+DESCENDING = -1
+
+
+def get_client():
+    global _client
+    if _client is None:
+        from pymongo import AsyncMongoClient
+
+        event_listeners = []
+        if METRICS_ENABLED:
+            from metrics import mongo_command_listener
+            event_listeners.append(mongo_command_listener())
+
+        # Create an async MongoDB client (one pool per worker, shared by every request)
+        _client = AsyncMongoClient(
+            MONGO_URI,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+            waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            event_listeners=event_listeners,
+        )
+    return _client
+
+
+def get_database():
+    return get_client()[DATABASE_NAME]
+
+
+async def warm_up():
+    """Creates the client and runs a ping so the first request finds an open connection."""
+    await get_database().command("ping")
+
+
+class _LazyDatabase:
+    def __getitem__(self, name):
+        return get_database()[name]
+
+    def __getattr__(self, attr):
+        return getattr(get_database(), attr)
+
+
+class _LazyCollection:
+    """Stands in for a collection until it is first used, then forwards everything to the real one."""
+
+    def __init__(self, name):
+        self.name = name
+        self._collection = None
+
+    def __getattr__(self, attr):
+        # Resolved once: building a collection object (database lookup, codec options) on every access adds up
+        if self._collection is None:
+            self._collection = get_database()[self.name]
+        return getattr(self._collection, attr)
 
-# Create a MongoDB client
-client = MongoClient(MONGO_URI)
 
 # Access the database
-db = client[DATABASE_NAME]
+db = _LazyDatabase()
 
 # Collections
-users_collection = db["users"]
-habits_collection = db["habits"]
-completions_collection = db["completions"]
\ No newline at end of file
+users_collection = _LazyCollection("users")
+habits_collection = _LazyCollection("habits")
+completions_collection = _LazyCollection("completions")
+completion_bitmaps_collection = _LazyCollection("completion_bitmaps")
+completion_buckets_collection = _LazyCollection("completion_buckets")
+jobs_collection = _LazyCollection("jobs")
\ No newline at end of file
@@ -0,0 +1,36 @@
+"""
+Cold start profile, enabled with IMPORT_PROFILE=true.
+
+main.py marks the end of each init phase; report() prints how long each phase took as one JSON line on stderr
+(visible in the Lambda logs). For a per-module breakdown use `python -X importtime -c "import main"` or
+benchmarks/bench_cold_start.py.
+"""
+import json
+import os
+import sys
+import time
+
+ENABLED = os.getenv("IMPORT_PROFILE", "false").lower() == "true"
+
+_started = time.perf_counter()
+_marks = []
+
+
+def mark(phase: str):
+    if ENABLED:
+        _marks.append((phase, time.perf_counter()))
+
+
+def report():
+    if not ENABLED:
+        return
+    phases = []
+    previous = _started
+    for phase, at in _marks:
+        phases.append({"phase": phase, "ms": round((at - previous) * 1000, 2)})
+        previous = at
+    print(json.dumps({
+        "cold_start_profile": phases,
+        "total_ms": round((previous - _started) * 1000, 2),
+        "modules_loaded": len(sys.modules),
+    }), file=sys.stderr)
\ No newline at end of file
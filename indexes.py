@@ -0,0 +1,184 @@
+"""
+Declarative index registry for every query crud.py runs.
+
+reconcile_indexes() is idempotent: missing indexes are created, indexes whose spec drifted are rebuilt and
+(optionally) undeclared ones are dropped. Run it at startup (ENSURE_INDEXES_ON_STARTUP=true) or through
+`python manage.py indexes`.
+"""
+from pymongo import ASCENDING, DESCENDING, IndexModel, DeleteMany
+from pymongo.errors import OperationFailure
+
+from db import db
+
+
+INDEXES = {
+    "users": [
+        # get_user_by_email, also enforces the "User with that email already exists." check in create_user
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+    ],
+    "habits": [
+        # get_user_habits, get_user_dashboard_data, rebalance_sort_indexes
+        IndexModel([("user_id", ASCENDING), ("sort_index", DESCENDING)], name="user_id_sort_index"),
+    ],
+    "completions": [
+        # upsert_completion, get_user_habit_completions, recompute_habit_streak,
+        # get_user_dashboard_data ($lookup on habit_id + user_id + date).
+        # Unique so concurrent upserts cannot duplicate a day.
+        IndexModel([("habit_id", ASCENDING), ("user_id", ASCENDING), ("date", ASCENDING)],
+                   name="habit_id_user_id_date_unique", unique=True),
+        # get_user_analytics (all of a user's completions in a date range)
+        IndexModel([("user_id", ASCENDING), ("date", ASCENDING)], name="user_id_date"),
+    ],
+    "completion_buckets": [
+        # COMPLETION_STORAGE=buckets: _find_completions and the dashboard $lookup (habit_id + month),
+        # get_user_analytics (user_id + month range)
+        IndexModel([("habit_id", ASCENDING), ("month", ASCENDING)], name="habit_id_month"),
+        IndexModel([("user_id", ASCENDING), ("month", ASCENDING)], name="user_id_month"),
+    ],
+    "jobs": [
+        # resume_jobs
+        IndexModel([("status", ASCENDING), ("lease_until", ASCENDING)], name="status_lease_until"),
+    ],
+    "completion_bitmaps": [
+        # get_user_heatmap, rebuild_habit_bitmaps
+        IndexModel([("user_id", ASCENDING), ("year", ASCENDING)], name="user_id_year"),
+        IndexModel([("habit_id", ASCENDING)], name="habit_id"),
+    ],
+}
+
+# Representative shape of every crud.py query, used by explain_queries() to catch collection scans.
+# (name, collection, filter, sort)
+QUERY_SHAPES = [
+    ("get_user_by_email", "users", {"email": "x@example.com"}, None),
+    ("get_user_habits", "habits", {"user_id": "x"}, [("sort_index", DESCENDING)]),
+    ("get_user_dashboard_data habits", "habits", {"user_id": "x", "archived": {"$ne": True}}, [("sort_index", DESCENDING)]),
+    ("get_user_dashboard_data $lookup", "completions", {"habit_id": "x", "user_id": "x", "date": "2025-01-01"}, None),
+    ("upsert_completion", "completions", {"habit_id": "x", "user_id": "x", "date": "2025-01-01"}, None),
+    ("get_user_habit_completions", "completions", {"habit_id": "x", "user_id": "x"}, [("date", DESCENDING)]),
+    ("get_user_heatmap", "completion_bitmaps", {"user_id": "x", "year": 2025}, None),
+    ("get_user_analytics", "completions", {"user_id": "x", "completed": True, "date": {"$gte": "2025-01-01", "$lte": "2025-12-31"}}, None),
+    ("get_user_habit_completions (buckets)", "completion_buckets", {"habit_id": "x", "user_id": "x"}, [("month", DESCENDING)]),
+    ("get_user_analytics (buckets)", "completion_buckets", {"user_id": "x", "month": {"$gte": "2025-01", "$lte": "2025-12"}}, None),
+    ("resume_jobs", "jobs", {"status": "running", "lease_until": {"$lt": 0}}, None),
+    ("cascade_delete_user completions", "completions", {"user_id": "x"}, None),
+    ("cascade_delete_habit bitmaps", "completion_bitmaps", {"habit_id": "x"}, None),
+    ("recompute_habit_streak", "completions", {"habit_id": "x", "completed": True}, [("date", ASCENDING)]),
+]
+
+# Index options that are compared when deciding whether an existing index matches its declaration
+_COMPARED_OPTIONS = ("unique", "sparse", "partialFilterExpression", "expireAfterSeconds")
+
+
+def _matches(existing: dict, declared: IndexModel) -> bool:
+    spec = declared.document
+    if list(existing["key"]) != list(spec["key"].items()):
+        return False
+    return all(existing.get(option) == spec.get(option) for option in _COMPARED_OPTIONS)
+
+
+async def reconcile_indexes(prune: bool = False):
+    """
+    Brings every collection in line with INDEXES. Returns a report of what was created, rebuilt or dropped.
+    :param prune: also drop indexes that are not declared (the _id index is always kept)
+    :return:
+    """
+    report = []
+    for collection_name, declared in INDEXES.items():
+        collection = db[collection_name]
+        existing = await collection.index_information()
+        declared_names = {index.document["name"] for index in declared}
+
+        for index in declared:
+            name = index.document["name"]
+            action = "unchanged"
+            if name in existing and not _matches(existing[name], index):
+                await collection.drop_index(name)
+                action = "rebuilt"
+            elif name not in existing:
+                action = "created"
+
+            if action != "unchanged":
+                try:
+                    await collection.create_indexes([index])
+                except OperationFailure as e:
+                    action = f"failed: {e.details.get('errmsg', str(e)) if e.details else str(e)}"
+            report.append({"collection": collection_name, "index": name, "action": action})
+
+        if prune:
+            for name in existing:
+                if name != "_id_" and name not in declared_names:
+                    await collection.drop_index(name)
+                    report.append({"collection": collection_name, "index": name, "action": "dropped"})
+    return report
+
+
+async def dedupe_completions(batch_size: int = 500, dry_run: bool = False):
+    """
+    Removes duplicate (habit_id, user_id, date) completions left behind by concurrent upserts, which would
+    otherwise stop the unique index from building. The newest document of each group is kept (completed wins
+    a tie) and the rest are deleted `batch_size` groups at a time, so no single write holds locks for long.
+    :return:
+    """
+    collection = db["completions"]
+    pipeline = [
+        {"$sort": {"timestamp": DESCENDING, "completed": DESCENDING}},
+        {"$group": {
+            "_id": {"habit_id": "$habit_id", "user_id": "$user_id", "date": "$date"},
+            "ids": {"$push": "$_id"},
+            "count": {"$sum": 1},
+        }},
+        {"$match": {"count": {"$gt": 1}}},
+    ]
+    groups = 0
+    deleted = 0
+    pending = []
+
+    async def flush():
+        nonlocal deleted
+        if pending and not dry_run:
+            result = await collection.bulk_write(pending, ordered=False)
+            deleted += result.deleted_count
+        pending.clear()
+
+    cursor = await collection.aggregate(pipeline, allowDiskUse=True, batchSize=batch_size)
+    async for group in cursor:
+        groups += 1
+        # ids are pushed newest first, keep the first one
+        pending.append(DeleteMany({"_id": {"$in": group["ids"][1:]}}))
+        if dry_run:
+            deleted += len(group["ids"]) - 1
+        if len(pending) >= batch_size:
+            await flush()
+    await flush()
+
+    return {"duplicate_groups": groups, "deleted": deleted, "dry_run": dry_run}
+
+
+def _stages(plan: dict):
+    yield plan.get("stage")
+    for child in ("inputStage", "innerStage", "outerStage"):
+        if child in plan:
+            yield from _stages(plan[child])
+    for child in plan.get("inputStages", []):
+        yield from _stages(child)
+
+
+async def explain_queries():
+    """
+    Explains every shape in QUERY_SHAPES and flags the ones whose winning plan is a collection scan.
+    :return:
+    """
+    report = []
+    for name, collection_name, query, sort in QUERY_SHAPES:
+        cursor = db[collection_name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = (await cursor.explain())["queryPlanner"]["winningPlan"]
+        stages = [stage for stage in _stages(plan) if stage]
+        report.append({
+            "query": name,
+            "collection": collection_name,
+            "stages": stages,
+            "uses_index": "COLLSCAN" not in stages,
+        })
+    return report
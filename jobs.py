@@ -0,0 +1,124 @@
+"""
+Background jobs tracked in the `jobs` collection.
+
+A job is started by a request, runs as an asyncio task after the response is sent, and records its status and
+progress in Mongo so it can be polled (GET /jobs/{job_id}). The runner holds a lease that it renews on every
+progress update. If a process dies mid-job the lease runs out and resume_jobs(), called once per process on
+startup, takes the job over and runs it again from the start, so job functions have to be idempotent.
+
+Every run holds its own lease id, and its progress and status writes only apply while the job still carries
+it. A runner that was paused past its lease (a frozen Lambda container) and has been taken over stops at its
+next progress update instead of running alongside the new one.
+"""
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException, status
+
+from config import JOB_LEASE_SECONDS
+from db import jobs_collection
+from metrics import background_context
+
+# kind -> async function(target, progress) doing the work, see register()
+_handlers = {}
+# Running tasks, referenced so they are not garbage collected mid-run
+_tasks = set()
+
+
+class LeaseLost(Exception):
+    """Raised by progress() when another runner has taken the job over."""
+
+
+def register(kind: str, handler):
+    """
+    Registers the function running jobs of `kind`. It is called as `await handler(target, progress)` where
+    `await progress(**counts)` adds to the job's progress counters and renews its lease, and raises LeaseLost
+    when the job was taken over, which ends the run.
+    """
+    _handlers[kind] = handler
+
+
+def _lease():
+    return datetime.now() + timedelta(seconds=JOB_LEASE_SECONDS)
+
+
+async def start_job(kind: str, target: str):
+    """Records a job and starts it in the background, returns the job document."""
+    now = datetime.now()
+    job = {
+        "_id": str(uuid.uuid4()),
+        "kind": kind,
+        "target": target,
+        "status": "running",
+        "progress": {},
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+        "lease_until": _lease(),
+        "lease_id": str(uuid.uuid4()),
+    }
+    await jobs_collection.insert_one(job)
+    _spawn(job)
+    return job
+
+
+def _spawn(job: dict):
+    task = asyncio.create_task(_run(job), context=background_context())
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def _run(job: dict):
+    owned = {"_id": job["_id"], "lease_id": job["lease_id"]}
+
+    async def progress(**counts):
+        result = await jobs_collection.update_one(owned, {
+            "$inc": {f"progress.{name}": count for name, count in counts.items()},
+            "$set": {"updated_at": datetime.now(), "lease_until": _lease()},
+        })
+        if result.matched_count == 0:
+            raise LeaseLost(job["_id"])
+
+    try:
+        await _handlers[job["kind"]](job["target"], progress)
+    except LeaseLost:
+        return
+    except Exception as e:
+        await jobs_collection.update_one(owned, {"$set": {
+            "status": "failed", "error": str(e), "updated_at": datetime.now(), "lease_until": None,
+        }})
+        return
+    await jobs_collection.update_one(owned, {"$set": {
+        "status": "done", "updated_at": datetime.now(), "finished_at": datetime.now(), "lease_until": None,
+    }})
+
+
+async def resume_jobs():
+    """Takes over the running jobs whose lease ran out (their process stopped), returns how many."""
+    from pymongo import ReturnDocument
+
+    resumed = 0
+    while True:
+        job = await jobs_collection.find_one_and_update(
+            {"status": "running", "lease_until": {"$lt": datetime.now()}, "kind": {"$in": list(_handlers)}},
+            {"$set": {"lease_until": _lease(), "lease_id": str(uuid.uuid4()), "updated_at": datetime.now()},
+             "$inc": {"attempts": 1}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if job is None:
+            return resumed
+        _spawn(job)
+        resumed += 1
+
+
+async def get_job(job_id: str):
+    try:
+        job = await jobs_collection.find_one({"_id": job_id, "kind": {"$exists": True}},
+                                             projection={"lease_until": 0, "lease_id": 0})
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail="An error occurred while fetching the job.")
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found.")
+    return job
@@ -1,12 +1,62 @@
+import import_profile
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from mangum import Mangum
-from routes import users, auth, habits, completions
+import_profile.mark("fastapi")
+from config import ENSURE_INDEXES_ON_STARTUP, WARM_UP_ON_INIT, ON_LAMBDA, METRICS_ENABLED, RATE_LIMIT_ENABLED
+from db import warm_up
+from password_tools import shutdown_password_pool
+from responses import MongoJSONResponse
+import_profile.mark("config")
+from routes import users, auth, habits, completions, jobs
+from crud import close_completion_write_buffer
+from jobs import resume_jobs
+import_profile.mark("routes")
+
+logger = logging.getLogger(__name__)
+
+# Mangum runs the lifespan around every Lambda invocation, the once per process startup work checks this
+_started = False
+
 
+async def warm_up_or_defer():
+    try:
+        await warm_up()
+    except Exception:
+        logger.warning("Mongo warm-up failed, connecting on first request instead", exc_info=True)
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _started
+    if WARM_UP_ON_INIT and not ON_LAMBDA:
+        await warm_up_or_defer()
+    if not _started:
+        _started = True
+        if ENSURE_INDEXES_ON_STARTUP:
+            from indexes import reconcile_indexes
+            await reconcile_indexes()
+        try:
+            # Jobs whose process stopped before they finished
+            await resume_jobs()
+        except Exception:
+            logger.exception("Resuming background jobs failed")
+    yield
+    await close_completion_write_buffer()
+    shutdown_password_pool()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=MongoJSONResponse)
 handler = Mangum(app)
 
+if RATE_LIMIT_ENABLED:
+    from ratelimit import RateLimitMiddleware
+    # Added before CORSMiddleware so that 429/503 responses still carry the CORS headers
+    app.add_middleware(RateLimitMiddleware)
 
 app.add_middleware(
     CORSMiddleware,
@@ -18,16 +68,62 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allow all HTTP methods
     allow_headers=["*"],  # Allow all headers
+    expose_headers=["ETag"],  # Let the front end read ETags for If-None-Match
 )
 
+if METRICS_ENABLED:
+    import metrics
+    from fastapi.responses import PlainTextResponse
+    from crud import principal_cache, completion_write_buffer, read_cache
+
+    app.add_middleware(metrics.MetricsMiddleware)
+    metrics.register_gauge("principal_cache_hits_total", "get_current_user cache hits.", lambda: principal_cache.hits, "counter")
+    metrics.register_gauge("principal_cache_misses_total", "get_current_user cache misses.", lambda: principal_cache.misses, "counter")
+    if completion_write_buffer is not None:
+        buffer = completion_write_buffer
+        metrics.register_gauge("completion_write_buffer_buffered_total", "Completion upserts accepted by the write buffer.", lambda: buffer.buffered, "counter")
+        metrics.register_gauge("completion_write_buffer_coalesced_total", "Completion upserts saved by coalescing.", lambda: buffer.coalesced, "counter")
+        metrics.register_gauge("completion_write_buffer_flushed_total", "Completion upserts written by buffer flushes.", lambda: buffer.flushed, "counter")
+        metrics.register_gauge("completion_write_buffer_flush_failures_total", "Failed write buffer flushes.", lambda: buffer.failures, "counter")
+        metrics.register_gauge("completion_write_buffer_pending", "Completion upserts waiting for the next flush.", lambda: len(buffer))
+    if read_cache is not None:
+        for namespace in ("habits", "dashboard"):
+            metrics.register_gauge(f"read_cache_{namespace}_hits_total", f"Read cache hits for {namespace} reads.", lambda ns=namespace: read_cache.hits.get(ns, 0), "counter")
+            metrics.register_gauge(f"read_cache_{namespace}_misses_total", f"Read cache misses for {namespace} reads.", lambda ns=namespace: read_cache.misses.get(ns, 0), "counter")
+            metrics.register_gauge(f"read_cache_{namespace}_hit_ratio", f"Read cache hit ratio for {namespace} reads.", lambda ns=namespace: read_cache.hit_ratio(ns) or 0)
+
+    if RATE_LIMIT_ENABLED:
+        from ratelimit import limiter
+        for policy in ("auth", "write", "read"):
+            metrics.register_gauge(f"rate_limited_{policy}_total", f"Requests rejected with 429 by the {policy} rate limit.", lambda p=policy: limiter.limited[p], "counter")
+        metrics.register_gauge("load_shed_total", "Requests rejected with 503 after waiting MAX_QUEUE_SECONDS for a slot.", lambda: limiter.shed, "counter")
+        metrics.register_gauge("requests_in_flight", "Requests holding a concurrency slot.", lambda: limiter.in_flight)
+
+    @app.get("/metrics", include_in_schema=False)
+    async def prometheus_metrics():
+        return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
 # Include routes
 app.include_router(auth.router, prefix="/auth", tags=["Auth"])
 app.include_router(users.router, prefix="/users", tags=["Users"])
 app.include_router(habits.router, prefix="/habits", tags=["Habits"])
 app.include_router(completions.router, prefix="/completions", tags=["Completions"])
+app.include_router(jobs.router, prefix="/jobs", tags=["Jobs"])
 
 
 
 @app.get("/")
 async def root():
-    return {"message": "Hello World"}
\ No newline at end of file
+    return {"message": "Hello World"}
+
+
+import_profile.mark("app")
+
+# Lambda init runs with boosted CPU and is not billed to the first request, so open the Mongo connection now.
+# No event loop is running during init, and Mangum reuses this same loop for every invocation, which keeps the
+# pool usable afterwards. Servers with a running loop (uvicorn) warm up in the lifespan instead.
+if WARM_UP_ON_INIT and ON_LAMBDA:
+    asyncio.get_event_loop().run_until_complete(warm_up_or_defer())
+    import_profile.mark("warm_up")
+
+import_profile.report()
\ No newline at end of file
@@ -0,0 +1,128 @@
+"""
+Maintenance commands, e.g.
+
+    python manage.py indexes
+    python manage.py dedupe-completions --dry-run
+    python manage.py explain-queries
+    python manage.py backfill-streaks
+    python manage.py purge-placeholders
+    python manage.py backfill-bitmaps
+    python manage.py migrate-buckets --chunk-size 5000
+    python manage.py prepare-completions --time-budget 600
+    python manage.py sweep-orphans --dry-run
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+
+async def _indexes(args):
+    from indexes import reconcile_indexes
+    return await reconcile_indexes(prune=args.prune)
+
+
+async def _dedupe_completions(args):
+    from indexes import dedupe_completions
+    return await dedupe_completions(batch_size=args.batch_size, dry_run=args.dry_run)
+
+
+async def _explain_queries(args):
+    from indexes import explain_queries
+    report = await explain_queries()
+    if any(not query["uses_index"] for query in report):
+        args.exit_code = 1
+    return report
+
+
+async def _backfill_streaks(args):
+    from crud import backfill_habit_streaks
+    return await backfill_habit_streaks(batch_size=args.batch_size)
+
+
+async def _purge_placeholders(args):
+    from crud import purge_placeholder_completions
+    return await purge_placeholder_completions(batch_size=args.batch_size)
+
+
+async def _backfill_bitmaps(args):
+    from crud import backfill_completion_bitmaps
+    return await backfill_completion_bitmaps(batch_size=args.batch_size)
+
+
+async def _migrate_buckets(args):
+    from buckets import migrate_completions
+    return await migrate_completions(chunk_size=args.chunk_size, restart=args.restart, max_chunks=args.max_chunks)
+
+
+async def _prepare_completions(args):
+    from crud import prepare_completions
+    options = {"batch_size": args.batch_size, "concurrency": args.concurrency, "time_budget": args.time_budget}
+    return await prepare_completions(restart=args.restart, **{k: v for k, v in options.items() if v is not None})
+
+
+async def _sweep_orphans(args):
+    from crud import sweep_orphans
+    return await sweep_orphans(batch_size=args.batch_size, dry_run=args.dry_run)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    indexes = commands.add_parser("indexes", help="create or rebuild the indexes declared in indexes.py")
+    indexes.add_argument("--prune", action="store_true", help="drop indexes that are not declared")
+    indexes.set_defaults(func=_indexes)
+
+    dedupe = commands.add_parser("dedupe-completions", help="delete duplicate (habit_id, user_id, date) completions")
+    dedupe.add_argument("--batch-size", type=int, default=500)
+    dedupe.add_argument("--dry-run", action="store_true")
+    dedupe.set_defaults(func=_dedupe_completions)
+
+    explain = commands.add_parser("explain-queries", help="flag crud queries that do not use an index")
+    explain.set_defaults(func=_explain_queries)
+
+    streaks = commands.add_parser("backfill-streaks", help="recompute every habit's streak counters from history")
+    streaks.add_argument("--batch-size", type=int, default=100)
+    streaks.set_defaults(func=_backfill_streaks)
+
+    purge = commands.add_parser("purge-placeholders", help="delete unchecked completions (SPARSE_COMPLETIONS only)")
+    purge.add_argument("--batch-size", type=int, default=1000)
+    purge.set_defaults(func=_purge_placeholders)
+
+    bitmaps = commands.add_parser("backfill-bitmaps", help="rebuild every habit's yearly completion bitmaps")
+    bitmaps.add_argument("--batch-size", type=int, default=50)
+    bitmaps.set_defaults(func=_backfill_bitmaps)
+
+    migrate = commands.add_parser("migrate-buckets", help="copy per-day completions into monthly buckets (resumable)")
+    migrate.add_argument("--chunk-size", type=int, default=5000)
+    migrate.add_argument("--restart", action="store_true", help="ignore the checkpoint and copy everything again")
+    migrate.add_argument("--max-chunks", type=int, help="stop after this many chunks, rerun to continue")
+    migrate.set_defaults(func=_migrate_buckets)
+
+    prepare = commands.add_parser("prepare-completions", help="write today's placeholder completions (resumable)")
+    # Defaults come from PREPARE_BATCH_SIZE, PREPARE_CONCURRENCY and PREPARE_TIME_BUDGET_SECONDS
+    prepare.add_argument("--batch-size", type=int)
+    prepare.add_argument("--concurrency", type=int)
+    prepare.add_argument("--time-budget", type=float, help="seconds")
+    prepare.add_argument("--restart", action="store_true", help="ignore an unfinished run and start over")
+    prepare.set_defaults(func=_prepare_completions)
+
+    sweep = commands.add_parser("sweep-orphans", help="delete habits, completions, buckets and bitmaps whose parent is gone")
+    sweep.add_argument("--batch-size", type=int, default=500)
+    sweep.add_argument("--dry-run", action="store_true", help="only count what would be deleted")
+    sweep.set_defaults(func=_sweep_orphans)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.exit_code = 0
+    result = asyncio.run(args.func(args))
+    print(json.dumps(result, indent=2, default=str))
+    return args.exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+"""
+Per-route request timing, Mongo command timing and Prometheus text output for GET /metrics.
+
+Everything here is off unless METRICS_ENABLED=true: main.py only installs the middleware and the route when it
+is on, db.py only registers the command listener, and observe_section() returns before reading the clock.
+"""
+import time
+from bisect import bisect_left
+from contextvars import ContextVar, copy_context
+
+
+from config import METRICS_ENABLED
+
+ENABLED = METRICS_ENABLED
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# ASGI scope of the request being handled; the router fills in scope["route"], so the route can be resolved
+# lazily by whatever is measured while the request runs (Mongo commands, bcrypt, serialization).
+_current_scope = ContextVar("metrics_scope", default=None)
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, label_names: tuple):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._series = {}
+
+    def observe(self, labels: tuple, value: float):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(BUCKETS) + 1), 0.0]
+        series[0][bisect_left(BUCKETS, value)] += 1
+        series[1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (counts, total) in self._series.items():
+            label_text = _labels(self.label_names, labels)
+            cumulative = 0
+            for bound, count in zip(BUCKETS, counts):
+                cumulative += count
+                yield f'{self.name}_bucket{{{label_text},le="{bound}"}} {cumulative}'
+            cumulative += counts[-1]
+            yield f'{self.name}_bucket{{{label_text},le="+Inf"}} {cumulative}'
+            yield f"{self.name}_sum{{{label_text}}} {total}"
+            yield f"{self.name}_count{{{label_text}}} {cumulative}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, label_names: tuple):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._series = {}
+
+    def inc(self, labels: tuple, amount: float = 1):
+        self._series[labels] = self._series.get(labels, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in self._series.items():
+            yield f"{self.name}{{{_labels(self.label_names, labels)}}} {value}"
+
+
+def _labels(names: tuple, values: tuple):
+    return ",".join(f'{name}="{str(value).replace(chr(34), chr(39))}"' for name, value in zip(names, values))
+
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Time spent handling a request.", ("method", "route", "status"))
+mongo_command_duration = Histogram(
+    "mongo_command_duration_seconds", "Mongo command round trips, attributed to the route that issued them.",
+    ("route", "command"))
+mongo_command_failures = Counter(
+    "mongo_command_failures_total", "Mongo commands that returned an error.", ("route", "command"))
+section_duration = Histogram(
+    "app_section_duration_seconds", "Time spent in instrumented sections (bcrypt, serialize) per route.",
+    ("route", "section"))
+
+_gauges = []
+
+
+def register_gauge(name: str, help_text: str, read, metric_type: str = "gauge"):
+    """Adds a value read at scrape time, e.g. cache counters. `read` returns a number."""
+    _gauges.append((name, help_text, read, metric_type))
+
+
+def current_route():
+    scope = _current_scope.get()
+    if scope is None:
+        return "background"
+    route = scope.get("route")
+    return route.path if route is not None else "unmatched"
+
+
+def background_context():
+    """
+    Copy of the current context without the request scope, for asyncio tasks started while handling a request
+    (asyncio.create_task(..., context=background_context())): what they measure is counted as "background"
+    instead of being charged to the route that happened to start them.
+    """
+    context = copy_context()
+    context.run(_current_scope.set, None)
+    return context
+
+
+def observe_section(section: str, started: float):
+    """Records the time since `started` (a time.perf_counter() value) for the current route."""
+    if ENABLED:
+        section_duration.observe((current_route(), section), time.perf_counter() - started)
+
+
+class MetricsMiddleware:
+    """Plain ASGI middleware (no BaseHTTPMiddleware) that times each request against its route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        token = _current_scope.set(scope)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_request_duration.observe(
+                (scope["method"], current_route(), status_code), time.perf_counter() - started)
+            _current_scope.reset(token)
+
+
+def mongo_command_listener():
+    """
+    Listener timing every Mongo command; the route is resolved from the request context the command runs in.
+    Built on first use so that importing this module (responses.py does) doesn't import pymongo.
+    """
+    from pymongo import monitoring
+
+    class MongoCommandListener(monitoring.CommandListener):
+        def started(self, event):
+            pass
+
+        def succeeded(self, event):
+            mongo_command_duration.observe((current_route(), event.command_name), event.duration_micros / 1e6)
+
+        def failed(self, event):
+            mongo_command_duration.observe((current_route(), event.command_name), event.duration_micros / 1e6)
+            mongo_command_failures.inc((current_route(), event.command_name))
+
+    return MongoCommandListener()
+
+
+def render_prometheus() -> str:
+    lines = []
+    for metric in (http_request_duration, mongo_command_duration, mongo_command_failures, section_duration):
+        lines.extend(metric.render())
+    for name, help_text, read, metric_type in _gauges:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        lines.append(f"{name} {read()}")
+    return "\n".join(lines) + "\n"
@@ -2,8 +2,8 @@ import uuid
 from datetime import datetime
 from datetime import date as _date
 from typing import Optional
-from pydantic import BaseModel, Field, EmailStr
-from bson import ObjectId
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from pydantic import BaseModel, Field, EmailStr, field_validator
 
 
 # def object_id_str(value: ObjectId) -> str:
@@ -18,12 +18,23 @@ class TokenData(BaseModel):
     email: str | None = None
 
 
+def _check_timezone(value: Optional[str]):
+    """IANA timezone name, e.g. "America/New_York"."""
+    if value is not None:
+        try:
+            ZoneInfo(value)
+        except (ZoneInfoNotFoundError, ValueError):
+            raise ValueError(f"Unknown timezone: {value}")
+    return value
+
+
 class User(BaseModel):
     id: str = Field(default_factory=uuid.uuid4, alias="_id")
     first_name: str = Field(...)
     last_name: str = Field(...)
     email: EmailStr = Field(...)
     hashed_password: str = Field(..., exclude=True)  # Exclude from serialization
+    timezone: Optional[str] = None
 
     class Config:
         populate_by_name = True
@@ -44,6 +55,9 @@ class UserCreate(BaseModel):
     last_name: str
     email: EmailStr
     password: str  # Accepts raw password from user input
+    timezone: Optional[str] = None
+
+    validate_timezone = field_validator("timezone")(_check_timezone)
 
     class Config:
         populate_by_name = True
@@ -53,6 +67,7 @@ class UserCreate(BaseModel):
                 "last_name": "Doe",
                 "email": "jdoe@gmail.com",
                 "password": "raw_password_here",
+                "timezone": "America/New_York",
             }
         }
 
@@ -62,6 +77,9 @@ class UserUpdate(BaseModel):
     last_name: Optional[str] = None
     email: Optional[EmailStr] = None
     password: Optional[str] = None  # Accepts raw password if the user wants to update it
+    timezone: Optional[str] = None
+
+    validate_timezone = field_validator("timezone")(_check_timezone)
 
     class Config:
         json_schema_extra = {
@@ -70,6 +88,7 @@ class UserUpdate(BaseModel):
                 "last_name": "Doe",
                 "email": "jdoe@gmail.com",
                 "password": "raw_password_here",
+                "timezone": "America/New_York",
             }
         }
 
@@ -86,6 +105,10 @@ class Habit(BaseModel):
     start_date: Optional[_date] = None
     end_date: Optional[_date] = None
     archived: bool = Field(default=False)
+    current_streak: int = Field(default=0)
+    longest_streak: int = Field(default=0)
+    last_completed_date: Optional[_date] = None
+    version: int = Field(default=0)
     created_at: datetime = Field(default_factory=datetime.now)
     updated_at: datetime = Field(default_factory=datetime.now)
 
@@ -104,6 +127,9 @@ class Habit(BaseModel):
                 "start_date": "2025-02-25",
                 "end_date": None,
                 "archived": False,
+                "current_streak": 3,
+                "longest_streak": 12,
+                "last_completed_date": "2025-02-25",
                 "created_at": "2025-02-25T08:00:00",
                 "updated_at": "2025-02-25T08:00:00"
             }
@@ -115,7 +141,7 @@ class HabitCreate(BaseModel):
     user_id: str
     name: str
     description: Optional[str] = None
-    sort_index: float = Field(...)
+    sort_index: Optional[float] = None  # ignored, new habits are placed on top
     category: Optional[str] = None
     color: Optional[str] = None
     icon: Optional[str] = None
@@ -165,6 +191,38 @@ class HabitUpdate(BaseModel):
         }
 
 
+class HabitMove(BaseModel):
+    above_id: Optional[str] = None
+    below_id: Optional[str] = None
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "above_id": "066de609-b04a-4b30-b46c-32537c7f1f6e",
+                "below_id": "7a1de609-b04a-4b30-b46c-32537c7f1f6e"
+            }
+        }
+
+
+class DashboardHabit(BaseModel):
+    id: str = Field(..., alias="_id")
+    user_id: str
+    name: str
+    description: Optional[str] = None
+    sort_index: float
+    category: Optional[str] = None
+    color: Optional[str] = None
+    icon: Optional[str] = None
+    current_streak: int = 0
+    longest_streak: int = 0
+    last_completed_date: Optional[_date] = None
+    completed: Optional[bool] = None
+    today_date: _date
+
+    class Config:
+        populate_by_name = True
+
+
 class Completion(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()), alias="_id")
     habit_id: str = Field(...)
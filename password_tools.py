@@ -1,23 +1,94 @@
-import bcrypt
+import asyncio
+import time
 import jwt
 from datetime import datetime, timedelta
-from passlib.context import CryptContext
+from functools import lru_cache
+from fastapi import HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 
 
 from config import SECRET_KEY, ALGORITHM
+from config import BCRYPT_ROUNDS, PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING
+from metrics import observe_section
 
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+@lru_cache(maxsize=None)
+def get_pwd_context():
+    """Built on first use, passlib is one of the slower imports on a cold start."""
+    from passlib.context import CryptContext
+
+    # min/max pinned to the work factor so hashes made with any other cost are flagged by needs_update
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__default_rounds=BCRYPT_ROUNDS,
+        bcrypt__min_rounds=BCRYPT_ROUNDS,
+        bcrypt__max_rounds=BCRYPT_ROUNDS,
+    )
 
 
 def get_password_hash(password: str):
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return get_pwd_context().verify(plain_password, hashed_password)
+
+
+def verify_and_update_password(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    """Verifies the password and, if the stored hash uses an outdated work factor, returns a new hash for it."""
+    return get_pwd_context().verify_and_update(plain_password, hashed_password)
+
+
+# ----------------------
+# Password hashing pool
+# ----------------------
+# bcrypt is CPU bound, so hashing runs in a process pool (or the default thread pool when
+# PASSWORD_HASH_WORKERS=0, e.g. on Lambda) and never on the event loop. At most PASSWORD_HASH_MAX_PENDING
+# calls may be queued or running; past that requests fail fast with 503 instead of piling up.
+_executor = None
+_pending = 0
+
+
+def _get_executor():
+    global _executor
+    if _executor is None and PASSWORD_HASH_WORKERS > 0:
+        from concurrent.futures import ProcessPoolExecutor
+        _executor = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS)
+    return _executor
+
+
+async def _run_in_pool(func, *args):
+    global _pending
+    if _pending >= PASSWORD_HASH_MAX_PENDING:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many password operations in progress, try again shortly.",
+            headers={"Retry-After": "1"},
+        )
+    _pending += 1
+    started = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_get_executor(), func, *args)
+    finally:
+        _pending -= 1
+        observe_section("bcrypt", started)
+
+
+async def get_password_hash_async(password: str) -> str:
+    return await _run_in_pool(get_password_hash, password)
+
+
+async def verify_and_update_password_async(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    return await _run_in_pool(verify_and_update_password, plain_password, hashed_password)
+
+
+def shutdown_password_pool():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
 
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
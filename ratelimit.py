@@ -0,0 +1,179 @@
+"""
+Request rate limiting and load shedding, installed by main.py when RATE_LIMIT_ENABLED=true.
+
+Every request is charged to a token bucket picked by its policy: POST /auth/* (login and register, each one a
+bcrypt call) per client IP, writes and reads per user (the `sub` of a valid bearer token, the client IP
+without one). A request finding its bucket empty gets a 429 straight from the middleware, before routing,
+Mongo or bcrypt. Buckets live in this process, so each worker (or Lambda instance) enforces its own limits.
+
+On top of that at most MAX_CONCURRENT_REQUESTS requests run at once; the others wait for a slot and are
+answered 503 once they have waited MAX_QUEUE_SECONDS, so a saturated worker sheds load instead of queueing
+requests that will time out anyway.
+"""
+import asyncio
+import math
+import time
+from collections import OrderedDict
+
+import orjson
+
+from config import RATE_LIMIT_AUTH, RATE_LIMIT_WRITE, RATE_LIMIT_READ, RATE_LIMIT_MAX_KEYS
+from config import MAX_CONCURRENT_REQUESTS, MAX_QUEUE_SECONDS
+from password_tools import decode_token
+
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+# Never limited: CORS preflights are answered by CORSMiddleware, /metrics is scraped
+EXEMPT_PATHS = {"/metrics"}
+
+
+def parse_rate(rate: str):
+    """(burst, tokens per second) of a "<requests>/<seconds>" policy, None for "" or "0" (no limit)."""
+    if not rate or rate == "0":
+        return None
+    requests, _, seconds = rate.partition("/")
+    return int(requests), int(requests) / float(seconds or 1)
+
+
+class TokenBuckets:
+    """Token buckets keyed by client, the least recently used ones are dropped past `max_keys`."""
+
+    def __init__(self, burst: int, per_second: float, max_keys: int):
+        self.burst = burst
+        self.per_second = per_second
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> [tokens, refilled_at]
+
+    def take(self, key) -> float:
+        """Takes a token for `key`, returns 0 if there was one, else the seconds until there is."""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(self.burst), now]
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.per_second)
+            bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0
+        return (1 - bucket[0]) / self.per_second
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+def _client_ip(scope):
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def _token_subject(scope):
+    """`sub` of the request's bearer token if it is valid, None otherwise."""
+    for name, value in scope.get("headers", ()):
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() != "bearer" or not token:
+                return None
+            try:
+                return decode_token(token).get("sub")
+            except Exception:
+                return None
+    return None
+
+
+class RateLimiter:
+    """The buckets of every policy, the concurrency slots and the counters exported as metrics."""
+
+    def __init__(self):
+        self.policies = {
+            name: TokenBuckets(*rate, max_keys=RATE_LIMIT_MAX_KEYS)
+            for name, rate in (("auth", parse_rate(RATE_LIMIT_AUTH)), ("write", parse_rate(RATE_LIMIT_WRITE)),
+                               ("read", parse_rate(RATE_LIMIT_READ)))
+            if rate is not None
+        }
+        self.limited = {name: 0 for name in ("auth", "write", "read")}
+        self.shed = 0
+        self.in_flight = 0
+        self.slots = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS) if MAX_CONCURRENT_REQUESTS > 0 else None
+
+    @staticmethod
+    def policy(scope):
+        method, path = scope["method"], scope["path"]
+        if method == "OPTIONS" or path in EXEMPT_PATHS:
+            return None
+        if method in WRITE_METHODS:
+            return "auth" if path.startswith("/auth/") else "write"
+        return "read"
+
+    def take(self, scope, policy: str) -> float:
+        """Charges the request to its bucket, returns 0 or the seconds until it would be allowed."""
+        buckets = self.policies.get(policy)
+        if buckets is None:
+            return 0
+        if policy == "auth":
+            key = _client_ip(scope)
+        else:
+            subject = _token_subject(scope)
+            key = f"user:{subject}" if subject else f"ip:{_client_ip(scope)}"
+        wait = buckets.take(key)
+        if wait:
+            self.limited[policy] += 1
+        return wait
+
+
+limiter = RateLimiter()
+
+
+class RateLimitMiddleware:
+    """Plain ASGI middleware answering 429 (rate limited) and 503 (shed) before the app sees the request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        policy = limiter.policy(scope)
+        if policy is None:
+            await self.app(scope, receive, send)
+            return
+        wait = limiter.take(scope, policy)
+        if wait:
+            await _reject(send, 429, "Too many requests, slow down.", wait)
+            return
+        if limiter.slots is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await asyncio.wait_for(limiter.slots.acquire(), MAX_QUEUE_SECONDS)
+        except asyncio.TimeoutError:
+            limiter.shed += 1
+            await _reject(send, 503, "Server is busy, try again shortly.", 1)
+            return
+        limiter.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.in_flight -= 1
+            limiter.slots.release()
+
+
+async def _reject(send, status_code: int, detail: str, retry_after: float):
+    body = orjson.dumps({"detail": detail})
+    await send({
+        "type": "http.response.start",
+        "status": status_code,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
@@ -0,0 +1,56 @@
+import csv
+import hashlib
+import io
+import time
+
+import orjson
+from fastapi.responses import ORJSONResponse, Response
+
+from metrics import observe_section
+
+
+class MongoJSONResponse(ORJSONResponse):
+    """
+    Renders Mongo documents straight to bytes with orjson (datetimes, dates and UUIDs natively, any other BSON
+    type such as ObjectId through str). Return it from a route to skip FastAPI's jsonable_encoder and
+    response_model passes; the route's response_model then only documents the shape.
+    """
+
+    def render(self, content) -> bytes:
+        started = time.perf_counter()
+        body = orjson.dumps(content, default=str, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+        observe_section("serialize", started)
+        return body
+
+
+def dumps_line(document) -> bytes:
+    """One NDJSON line."""
+    return orjson.dumps(document, default=str, option=orjson.OPT_APPEND_NEWLINE)
+
+
+def dumps_csv_row(values) -> bytes:
+    """One CSV line, None as an empty field and booleans as true/false."""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(
+        ["" if value is None else str(value).lower() if isinstance(value, bool) else value for value in values]
+    )
+    return buffer.getvalue().encode()
+
+
+def make_etag(*parts) -> str:
+    """Strong ETag (quoted hex digest) of any orjson-serializable parts."""
+    digest = hashlib.blake2b(orjson.dumps(parts, default=str), digest_size=16).hexdigest()
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """If-None-Match check (weak comparison, as RFC 9110 requires for this header)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
@@ -5,7 +5,7 @@ from typing import Annotated
 
 
 from config import ACCESS_TOKEN_EXPIRE_MINUTES
-from crud import authenticate_user, get_current_user, register_user, get_user_by_email
+from crud import authenticate_user, get_current_user, register_user, get_user_by_email, principal_cache
 from models import User, UserCreate, Token
 from password_tools import create_access_token
 
@@ -15,19 +15,19 @@ router = APIRouter()
 
 
 @router.post("/register")
-def register(user: UserCreate):
-    return register_user(user)
+async def register(user: UserCreate):
+    return await register_user(user)
 
 
 @router.post("/token")
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()) -> Token:
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()) -> Token:
     """
     OAuth2 compatible token login, return an access token for future requests (send to front end to hold on to)
     :param form_data:
     :return:
     """
     # OAuth2PasswordRequestForm expects "username" but we give it an email
-    user = authenticate_user(email=form_data.username, password=form_data.password)
+    user = await authenticate_user(email=form_data.username, password=form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -57,4 +57,14 @@ async def read_users_me(
 async def read_own_items(
     current_user: Annotated[User, Depends(get_current_user)],
 ):
-    return [{"item_id": "Foo", "owner": current_user.email}]
\ No newline at end of file
+    return [{"item_id": "Foo", "owner": current_user.email}]
+
+
+@router.get("/principal_cache")
+async def read_principal_cache_stats(current_user: Annotated[User, Depends(get_current_user)]):
+    """
+    Hit/miss counters of the authenticated user cache used by get_current_user, of this process only
+    :param current_user:
+    :return:
+    """
+    return principal_cache.stats()
\ No newline at end of file
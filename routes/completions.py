@@ -1,37 +1,45 @@
 from fastapi import APIRouter, status
 
-from models import CompletionCreate, CompletionUpdate, CompletionUpsert
+from models import Completion, CompletionCreate, CompletionUpdate, CompletionUpsert
+from responses import MongoJSONResponse
 from crud import create_completion, get_completion, update_completion, upsert_completion, prepare_completions
+from crud import upsert_completions_batch
 
 
 router = APIRouter()
 
 
 @router.post(path="", response_description="Create a new completion.", status_code=status.HTTP_201_CREATED, response_model=dict)
-def create_completion_route(completion: CompletionCreate):
-    result = create_completion(completion)
+async def create_completion_route(completion: CompletionCreate):
+    result = await create_completion(completion)
     return result
 
 
-@router.get(path="/{completion_id}", response_description="Retrieve completion details by completion_id.", status_code=status.HTTP_200_OK, response_model=dict)
-def get_completion_route(completion_id: str):
-    result = get_completion(completion_id)
-    return result
+@router.get(path="/{completion_id}", response_description="Retrieve completion details by completion_id.", status_code=status.HTTP_200_OK, response_model=Completion)
+async def get_completion_route(completion_id: str):
+    result = await get_completion(completion_id)
+    return MongoJSONResponse(result)
 
 
 @router.patch(path="/{completion_id}", response_description="Update completion details by completion_id.", status_code=status.HTTP_200_OK, response_model=dict)
-def update_completion_route(completion_id: str, completion: CompletionUpdate):
-    result = update_completion(completion_id, completion)
-    return result
+async def update_completion_route(completion_id: str, completion: CompletionUpdate):
+    result = await update_completion(completion_id, completion)
+    return MongoJSONResponse(result)
 
 
 @router.post(path="/prepare_completions", response_description="Prepare uncompleted completions for current day", status_code=status.HTTP_201_CREATED, response_model=dict)
-def prepare_completions_route():
-    result = prepare_completions()
+async def prepare_completions_route():
+    result = await prepare_completions()
     return result
 
 
 @router.put(path="/upsert", response_description="Preforms a completion collection upsert using user_id, habit_id, and date", status_code=status.HTTP_201_CREATED, response_model=dict)
-def upsert_completion_route(completion: CompletionUpsert):
-    result = upsert_completion(completion)
+async def upsert_completion_route(completion: CompletionUpsert):
+    result = await upsert_completion(completion)
+    return result
+
+
+@router.put(path="/upsert/batch", response_description="Upserts a list of completions with one bulk write, returns a result per item", status_code=status.HTTP_200_OK, response_model=dict)
+async def upsert_completions_batch_route(completions: list[CompletionUpsert]):
+    result = await upsert_completions_batch(completions)
     return result
\ No newline at end of file
@@ -1,34 +1,50 @@
 from pprint import pprint
+from typing import Optional
 
-from fastapi import APIRouter, status
+from fastapi import APIRouter, Header, status
 
-from models import Habit, HabitCreate, HabitUpdate
-from crud import create_habit, get_habit, update_habit, delete_habit
+from models import Habit, HabitCreate, HabitUpdate, HabitMove
+from crud import create_habit, get_habit, update_habit, delete_habit, move_habit
+from crud import VERSION_FIELDS, versions_etag
+from responses import MongoJSONResponse, etag_matches, not_modified
 
 
 router = APIRouter()
 
 
 @router.post(path="", response_description="Create a new habit.", status_code=status.HTTP_201_CREATED, response_model=dict)
-def create_habit_route(habit: HabitCreate):
-    result = create_habit(habit)
+async def create_habit_route(habit: HabitCreate):
+    result = await create_habit(habit)
     return result
 
 
-@router.get(path="/{habit_id}", response_description="Retrieve habit details by habit_id.", status_code=status.HTTP_200_OK, response_model=dict)
-def get_habit_route(habit_id: str):
-    result = get_habit(habit_id)
-    return result
+@router.get(path="/{habit_id}", response_description="Retrieve habit details by habit_id.", status_code=status.HTTP_200_OK, response_model=Habit)
+async def get_habit_route(habit_id: str, if_none_match: Optional[str] = Header(None)):
+    if if_none_match:
+        versions = await get_habit(habit_id, projection=VERSION_FIELDS)
+        etag = versions_etag([versions]) if versions is not None else None
+        if etag and etag_matches(if_none_match, etag):
+            return not_modified(etag)
+    result = await get_habit(habit_id)
+    if result is None:
+        return MongoJSONResponse(result)
+    return MongoJSONResponse(result, headers={"ETag": versions_etag([result])})
 
 
 @router.patch(path="/{habit_id}", response_description="Update habit details by habit_id.", status_code=status.HTTP_200_OK, response_model=dict)
-def update_habit_route(habit_id: str, habit_update: HabitUpdate):
-    result = update_habit(habit_id, habit_update)
+async def update_habit_route(habit_id: str, habit_update: HabitUpdate):
+    result = await update_habit(habit_id, habit_update)
+    return MongoJSONResponse(result)
+
+
+@router.post(path="/{habit_id}/move", response_description="Move a habit between two neighbours.", status_code=status.HTTP_200_OK, response_model=dict)
+async def move_habit_route(habit_id: str, move: HabitMove):
+    result = await move_habit(habit_id, move)
     return result
 
 
-@router.delete(path="/{habit_id}", response_description="Delete a habit by habit_id.", status_code=status.HTTP_200_OK, response_model=dict)
-def delete_habit_route(habit_id: str):
-    result = delete_habit(habit_id)
+@router.delete(path="/{habit_id}", response_description="Delete a habit by habit_id, its completions are removed by a background job.", status_code=status.HTTP_202_ACCEPTED, response_model=dict)
+async def delete_habit_route(habit_id: str):
+    result = await delete_habit(habit_id)
     return result
 
@@ -0,0 +1,12 @@
+from fastapi import APIRouter, status
+
+from jobs import get_job
+
+
+router = APIRouter()
+
+
+@router.get(path="/{job_id}", response_description="Status and progress of a background job.", status_code=status.HTTP_200_OK, response_model=dict)
+async def get_job_route(job_id: str):
+    result = await get_job(job_id)
+    return result
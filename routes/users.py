@@ -1,54 +1,159 @@
-from fastapi import APIRouter, status
+from datetime import date as _date
+from typing import Literal, Optional
 
-from models import User, UserCreate, UserUpdate
+from fastapi import APIRouter, Header, Query, Request, status
+from fastapi.responses import StreamingResponse
+
+from models import User, UserCreate, UserUpdate, Habit, Completion, DashboardHabit
+from responses import MongoJSONResponse, dumps_line, dumps_csv_row, etag_matches, not_modified
 from crud import create_user, get_user, update_user, delete_user
 from crud import get_user_habits, get_user_habit_completions, get_user_habit_completion_streak, get_user_dashboard_data
+from crud import iter_user_habit_completions, get_user_heatmap, reorder_user_habits
+from crud import export_user_data, import_user_data, EXPORT_CSV_COLUMNS
+from crud import VERSION_FIELDS, versions_etag, dashboard_etag, get_user_dashboard_etag, field_projection
+from analytics import get_user_analytics
+from config import COMPLETION_PAGE_SIZE, MAX_COMPLETION_PAGE_SIZE
 
 
 router = APIRouter()
 
+FIELDS_DESCRIPTION = "Comma separated fields to return (e.g. id,name), all of them when omitted."
+
 
 @router.post(path="", response_description="Create a new user", response_model=dict, status_code=status.HTTP_201_CREATED)
-def create_user_route(user: UserCreate):
-    result = create_user(user)
+async def create_user_route(user: UserCreate):
+    result = await create_user(user)
     return result
 
-@router.get(path="/{user_id}", response_description="Retrieve user details by user_id.", response_model=dict, status_code=status.HTTP_200_OK )
-def get_user_route(user_id: str):
-    result = get_user(user_id)
-    return result
+@router.get(path="/{user_id}", response_description="Retrieve user details by user_id.", response_model=User, status_code=status.HTTP_200_OK )
+async def get_user_route(user_id: str, if_none_match: Optional[str] = Header(None)):
+    if if_none_match:
+        etag = versions_etag([await get_user(user_id, projection=VERSION_FIELDS)])
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+    result = await get_user(user_id)
+    return MongoJSONResponse(result, headers={"ETag": versions_etag([result])})
 
 @router.patch(path="/{user_id}", response_description="Update user details by user_id.", response_model=dict, status_code=status.HTTP_200_OK)
-def update_user_route(user_id: str, user: UserUpdate):
-    result = update_user(user_id, user)
-    return result
+async def update_user_route(user_id: str, user: UserUpdate):
+    result = await update_user(user_id, user)
+    return MongoJSONResponse(result)
 
-@router.delete(path="/{user_id}", response_description="Delete a user by user_id.", status_code=status.HTTP_200_OK, response_model=dict)
-def delete_user_route(user_id: str):
-    result = delete_user(user_id)
+@router.delete(path="/{user_id}", response_description="Delete a user by user_id, their habits and completions are removed by a background job.", status_code=status.HTTP_202_ACCEPTED, response_model=dict)
+async def delete_user_route(user_id: str):
+    result = await delete_user(user_id)
     return result
 
 
-@router.get(path="/{user_id}/habits", response_description="Get all habits associated with a user_id.", status_code=status.HTTP_200_OK, response_model=list)
-def get_user_habits_route(user_id: str):
-    result = get_user_habits(user_id)
-    return result
+@router.get(path="/{user_id}/habits", response_description="Get all habits associated with a user_id.", status_code=status.HTTP_200_OK, response_model=list[Habit])
+async def get_user_habits_route(user_id: str, fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+                                if_none_match: Optional[str] = Header(None)):
+    projection = field_projection(fields, Habit, required=VERSION_FIELDS)
+    # A field selection is a different representation, so it gets its own ETag
+    extra = (list(projection),) if projection else ()
+    if if_none_match:
+        etag = versions_etag(await get_user_habits(user_id, projection=VERSION_FIELDS), *extra)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+    result = await get_user_habits(user_id, projection=projection)
+    return MongoJSONResponse(result, headers={"ETag": versions_etag(result, *extra)})
 
 
-@router.get(path="/{user_id}/habits/{habit_id}", response_description="Get all user habit completions by user_id and habit_id.", status_code=status.HTTP_200_OK, response_model=list)
-def get_user_habit_completions_route(user_id: str, habit_id: str):
-    result = get_user_habit_completions(user_id, habit_id)
+@router.put(path="/{user_id}/habits/order", response_description="Reorder all of a user's habits (ids top to bottom).", status_code=status.HTTP_200_OK, response_model=dict)
+async def reorder_user_habits_route(user_id: str, habit_ids: list[str]):
+    result = await reorder_user_habits(user_id, habit_ids)
     return result
 
 
+@router.get(path="/{user_id}/habits/{habit_id}", response_description="Get a page of user habit completions by user_id and habit_id, newest first.", status_code=status.HTTP_200_OK, response_model=list[Completion])
+async def get_user_habit_completions_route(
+    user_id: str,
+    habit_id: str,
+    date_from: Optional[_date] = Query(None, alias="from"),
+    date_to: Optional[_date] = Query(None, alias="to"),
+    before: Optional[_date] = Query(None, description="Date of the last completion of the previous page."),
+    limit: int = Query(COMPLETION_PAGE_SIZE, ge=1, le=MAX_COMPLETION_PAGE_SIZE),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+):
+    # `date` is kept for paging with `before`
+    projection = field_projection(fields, Completion, required=("_id", "date"))
+    result = await get_user_habit_completions(user_id, habit_id, date_from, date_to, before, limit, projection)
+    return MongoJSONResponse(result)
+
+
+@router.get(path="/{user_id}/habits/{habit_id}/stream", response_description="Stream all user habit completions as NDJSON, newest first.", status_code=status.HTTP_200_OK)
+async def stream_user_habit_completions_route(
+    user_id: str,
+    habit_id: str,
+    date_from: Optional[_date] = Query(None, alias="from"),
+    date_to: Optional[_date] = Query(None, alias="to"),
+):
+    async def lines():
+        async for completion in iter_user_habit_completions(user_id, habit_id, date_from, date_to):
+            yield dumps_line(completion)
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
 @router.get(path="/{user_id}/habits/{habit_id}/completion_streak", response_description="Get current streak for user habit.", status_code=status.HTTP_200_OK, response_model=dict)
-def get_user_habit_completion_streak_route(user_id: str, habit_id: str):
-    result = get_user_habit_completion_streak(user_id, habit_id)
+async def get_user_habit_completion_streak_route(user_id: str, habit_id: str):
+    result = await get_user_habit_completion_streak(user_id, habit_id)
+    return result
+
+
+@router.get(path="/{user_id}/dashboard", response_description="Get data required for dashboard.", status_code=status.HTTP_200_OK, response_model=list[DashboardHabit])
+async def get_user_dashboard_data_route(user_id: str, date: Optional[_date] = None,
+                                        fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+                                        if_none_match: Optional[str] = Header(None)):
+    projection = field_projection(fields, DashboardHabit, required=VERSION_FIELDS)
+    extra = (list(projection),) if projection else ()
+    if if_none_match:
+        etag = await get_user_dashboard_etag(user_id, date, *extra)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+    result = await get_user_dashboard_data(user_id, date, projection)
+    return MongoJSONResponse(result, headers={"ETag": dashboard_etag(user_id, result, date, *extra)})
+
+
+
+
+@router.get(path="/{user_id}/heatmap", response_description="Get a year of completions for all of a user's habits as bitmaps.", status_code=status.HTTP_200_OK, response_model=dict)
+async def get_user_heatmap_route(user_id: str, year: Optional[int] = None, encoding: Literal["base64", "runs"] = "base64"):
+    result = await get_user_heatmap(user_id, year or _date.today().year, encoding)
     return result
 
 
-@router.get(path="/{user_id}/dashboard", response_description="Get data required for dashboard.", status_code=status.HTTP_200_OK, response_model=list)
-def get_user_dashboard_data_route(user_id: str):
-    result = get_user_dashboard_data(user_id)
+@router.get(path="/{user_id}/analytics", response_description="Completion rates, streaks and weekly/monthly/weekday rollups for all of a user's habits.", status_code=status.HTTP_200_OK, response_model=dict)
+async def get_user_analytics_route(
+    user_id: str,
+    date_from: Optional[_date] = Query(None, alias="from"),
+    date_to: Optional[_date] = Query(None, alias="to"),
+):
+    result = await get_user_analytics(user_id, date_from, date_to)
     return result
 
+
+@router.get(path="/{user_id}/export", response_description="Stream all of a user's habits and then their completions as NDJSON or CSV.", status_code=status.HTTP_200_OK)
+async def export_user_data_route(user_id: str, format: Literal["ndjson", "csv"] = "ndjson"):
+    rows = await export_user_data(user_id)
+
+    if format == "csv":
+        async def lines():
+            yield dumps_csv_row(EXPORT_CSV_COLUMNS)
+            async for kind, document in rows:
+                yield dumps_csv_row([kind if column == "type" else document.get(column) for column in EXPORT_CSV_COLUMNS])
+        media_type = "text/csv"
+    else:
+        async def lines():
+            async for kind, document in rows:
+                yield dumps_line({"type": kind, **document})
+        media_type = "application/x-ndjson"
+
+    headers = {"Content-Disposition": f'attachment; filename="habits-{user_id}.{format}"'}
+    return StreamingResponse(lines(), media_type=media_type, headers=headers)
+
+
+@router.post(path="/{user_id}/import", response_description="Import habits and completions in the export format (NDJSON or CSV body), returns per-row errors.", status_code=status.HTTP_200_OK, response_model=dict)
+async def import_user_data_route(user_id: str, request: Request, format: Literal["ndjson", "csv"] = "ndjson"):
+    result = await import_user_data(user_id, request.stream(), format)
+    return result
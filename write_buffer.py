@@ -0,0 +1,94 @@
+import asyncio
+import logging
+from datetime import datetime
+
+from metrics import background_context
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBuffer:
+    """
+    Write-behind buffer that coalesces writes to the same key. Only the last value written for a key within a
+    flush window is kept; `flush` receives the surviving (value, written_at) pairs and is awaited every
+    `interval` seconds, as soon as `max_pending` keys are waiting, and on `close`.
+
+    Pending values can be read back with `get` so callers keep read-your-writes consistency.
+    """
+
+    def __init__(self, flush, interval: float, max_pending: int):
+        self._flush = flush
+        self.interval = interval
+        self.max_pending = max_pending
+        self.buffered = 0   # writes accepted
+        self.coalesced = 0  # writes replaced by a later write to the same key before they were flushed
+        self.flushed = 0    # writes sent to the database
+        self.flushes = 0
+        self.failures = 0
+        self._pending = {}
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def get(self, key, default=None):
+        entry = self._pending.get(key)
+        return default if entry is None else entry[0]
+
+    def discard_where(self, predicate):
+        """Drops the pending writes whose key matches `predicate`, returns how many were dropped."""
+        keys = [key for key in self._pending if predicate(key)]
+        for key in keys:
+            del self._pending[key]
+        return len(keys)
+
+    async def put(self, key, value):
+        if key in self._pending:
+            self.coalesced += 1
+        # Re-inserting keeps the dict in the order the keys were last written
+        self._pending.pop(key, None)
+        self._pending[key] = (value, datetime.now())
+        self.buffered += 1
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), context=background_context())
+        if len(self._pending) >= self.max_pending:
+            await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            if not self._pending:
+                return 0
+            pending, self._pending = self._pending, {}
+            try:
+                await self._flush(list(pending.values()))
+            except BaseException:
+                # Put the writes back unless a newer value for the key came in while flushing, also when the
+                # flush is cancelled: the clients were already told these writes succeeded
+                self.failures += 1
+                for key, entry in pending.items():
+                    self._pending.setdefault(key, entry)
+                raise
+            self.flushes += 1
+            self.flushed += len(pending)
+            return len(pending)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                # Shielded so that close() cancelling this loop lets a flush in progress finish
+                await asyncio.shield(self.flush())
+            except Exception:
+                logger.exception("Write buffer flush failed, retrying in %ss", self.interval)
+
+    async def close(self):
+        """
+        Stops the periodic flush and writes out whatever is still pending, after a flush in progress (which
+        holds the lock) is done.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()